@@ -0,0 +1,156 @@
+"""
+Versión async (Firestore AsyncClient) de las operaciones del camino caliente de la API.
+Comparte caches, cursores y armado de consultas con services.py, que sigue siendo la
+capa sync usada por scripts, páginas HTML y endpoints poco frecuentes.
+"""
+from __future__ import annotations
+from typing import Any, AsyncIterator, Dict, Optional
+from firebase_config import async_db
+from config import COLL_PROJECTS, COLL_CHATS, EXPORT_PAGE_SIZE
+from config import GROUP_COMMIT_ENABLED, GROUP_COMMIT_MAX_DELAY_MS, GROUP_COMMIT_MAX_BATCH, FIRESTORE_BATCH_LIMIT
+from cache import MISSING
+from group_commit import GroupCommitter
+from services import (
+    check_project_auth, doc_item, chats_query, chats_page, unread_queries, messages_query, messages_page,
+    prepare_message, message_written, encode_cursor, recent_messages_page, recent_fill_limit, recent_fill,
+    recent_catch_up_query, recent_catch_up,
+    prepare_messages, group_written, now_utc,
+)
+import metrics
+
+
+# Projects
+async def get_project(project_id: str):
+    snap = await async_db.collection(COLL_PROJECTS).document(project_id).get()
+    return snap.to_dict() if snap.exists else None
+
+async def list_projects():
+    return [d.to_dict() async for d in async_db.collection(COLL_PROJECTS).stream()]
+
+async def validate_project_auth(project_id: str, api_key: str):
+    ok = check_project_auth(project_id, api_key)
+    if ok is MISSING:
+        ok = check_project_auth(project_id, api_key, await get_project(project_id))
+    return ok
+
+
+# Chats
+async def get_chat(chat_id: str):
+    snap = await async_db.collection(COLL_CHATS).document(chat_id).get()
+    if not snap.exists: return None
+    return doc_item(snap)
+
+async def list_chats(project_id: str, user_id: Optional[str] = None, limit: Optional[int] = None,
+                     cursor: Optional[str] = None, order: str = "created"):
+    q, field = chats_query(async_db, project_id, user_id, limit, cursor, order)
+    page = chats_page([doc_item(d) async for d in q.stream()], limit, field, user_id)
+    for chat in page["chats"]:
+        if user_id and "unread_count" not in chat:
+            total, own = unread_queries(async_db, chat["id"], chat, user_id)
+            chat["unread_count"] = max(0, await _count(total) - await _count(own))
+    return page
+
+async def _count(query) -> int:
+    result = await query.count().get()
+    return int(result[0][0].value) if result else 0
+
+
+# Messages
+async def add_message(chat_id: str, sender_id: str, text: str, chat: Optional[Dict[str, Any]] = None):
+    if chat is None:
+        chat = await get_chat(chat_id) or {}
+    if _group_commit is not None:
+        return await _group_commit.submit(chat_id, (sender_id, text, chat))
+    batch, msg, summary = prepare_message(async_db, chat_id, sender_id, text, chat)
+    await batch.commit()
+    message_written(chat_id, msg, summary, chat, from_event_loop=True)
+    return msg
+
+async def _commit_group(chat_id: str, items):
+    """Escribe juntos los mensajes (sender_id, text, chat) que juntó el GroupCommitter para un chat."""
+    chats = [chat for _, _, chat in items]
+    batch, msgs, summary = prepare_messages(async_db, chat_id, [(s, t) for s, t, _ in items],
+                                            chats[0].get("users", []), now_utc())
+    await batch.commit()
+    group_written(chat_id, msgs, summary, chats)
+    return msgs
+
+# Commit agrupado (opcional): cada lote es un solo WriteBatch, así que no puede pasar del límite de Firestore
+_group_commit = GroupCommitter(
+    _commit_group,
+    max_delay=GROUP_COMMIT_MAX_DELAY_MS / 1000,
+    max_batch=min(GROUP_COMMIT_MAX_BATCH, FIRESTORE_BATCH_LIMIT - 1),
+    on_flush=lambda size, reason, seconds: metrics.observe_group_commit(size, _group_commit.max_batch, reason, seconds),
+) if GROUP_COMMIT_ENABLED else None
+
+def group_commit_stats():
+    return _group_commit.stats() if _group_commit is not None else {"enabled": False}
+
+async def list_messages(chat_id: str, limit: Optional[int] = None, before: Optional[str] = None,
+                        after: Optional[str] = None, newest_first: bool = False,
+                        chat: Optional[Dict[str, Any]] = None):
+    page = recent_messages_page(chat_id, chat, limit, before, after, newest_first)
+    if page is not None:
+        return page
+    catch_up = recent_catch_up_query(async_db, chat_id, chat, limit, before, after, newest_first)
+    if catch_up is not None:
+        q, since = catch_up
+        recent_catch_up(chat_id, chat, since, [doc_item(d) async for d in q.stream()])
+        page = recent_messages_page(chat_id, chat, limit, before, after, newest_first)
+        if page is not None:
+            return page
+    fill = recent_fill_limit(chat, limit, before, after, newest_first)
+    q, descending, cursor = messages_query(async_db, chat_id, fill or limit, before, after, newest_first)
+    out = [doc_item(d) async for d in q.stream()]
+    if fill:
+        recent_fill(chat_id, chat, out, fill)
+    return messages_page(out, limit, descending, newest_first, cursor)
+
+
+# Exportación en streaming: se lee de a EXPORT_PAGE_SIZE documentos con cursores, así la
+# memoria usada no depende del tamaño del historial
+def stream_messages(chat_id: str, before: Optional[str] = None, after: Optional[str] = None,
+                    newest_first: bool = False, limit: Optional[int] = None) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Mensajes del chat en el orden de la consulta: ascendente con `after`, descendente con
+    `before`, y según `newest_first` sin cursor. Los cursores se validan antes de empezar
+    (ValueError), para poder responder 400 antes de enviar el cuerpo.
+    """
+    messages_query(async_db, chat_id, None, before, after, newest_first)
+    return _stream_messages(chat_id, before, after, newest_first, limit)
+
+async def _stream_messages(chat_id, before, after, newest_first, limit):
+    remaining = limit
+    while remaining is None or remaining > 0:
+        size = EXPORT_PAGE_SIZE if remaining is None else min(EXPORT_PAGE_SIZE, remaining)
+        q, descending, _ = messages_query(async_db, chat_id, size, before, after, newest_first)
+        n, last, has_more = 0, None, False
+        async for d in q.stream():
+            # El documento +1 solo indica que hay más: se consume el stream entero (sin
+            # cortarlo) para que la consulta cierre y se contabilice normalmente
+            if n == size:
+                has_more = True
+                continue
+            last = doc_item(d)
+            n += 1
+            yield last
+        if not has_more:
+            return
+        if remaining is not None:
+            remaining -= n
+        cursor = encode_cursor(last["timestamp"], last["id"])
+        before, after = (cursor, None) if descending else (None, cursor)
+
+async def stream_project(project_id: str) -> AsyncIterator[Dict[str, Any]]:
+    """Todos los chats del proyecto (más recientes primero), cada uno seguido de sus mensajes."""
+    cursor = None
+    while True:
+        q, field = chats_query(async_db, project_id, None, EXPORT_PAGE_SIZE, cursor, "created")
+        page = chats_page([doc_item(d) async for d in q.stream()], EXPORT_PAGE_SIZE, field, None)
+        for chat in page["chats"]:
+            yield {"type": "chat", "data": chat}
+            async for msg in _stream_messages(chat["id"], None, None, False, None):
+                yield {"type": "message", "chat_id": chat["id"], "data": msg}
+        if not page["has_more"]:
+            return
+        cursor = page["next_cursor"]
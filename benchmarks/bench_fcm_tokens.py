@@ -0,0 +1,56 @@
+"""
+Benchmark de resolución de tokens FCM por notificación.
+
+Compara, para chats de 2, 50 y 500 miembros, las llamadas a Firestore que hace
+send_push_notification: antes (un get por miembro) y ahora (get_all agrupado + cache).
+Corre sobre el backend en memoria (STORAGE_BACKEND=memory): los round-trips salen de la
+contabilidad por bloque de instrumentation.py y los documentos leídos de op_counts().
+
+Uso:
+    python benchmarks/bench_fcm_tokens.py
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ["STORAGE_BACKEND"] = "memory"
+os.environ["FIRESTORE_INSTRUMENTATION"] = "1"
+
+
+def main():
+    import services
+    from config import COLL_CHATS, COLL_FCM_TOKENS
+    from instrumentation import request_accounting
+
+    class _Resp:
+        def __init__(self, n):
+            self.success_count = n
+            self.failure_count = 0
+
+    services.messaging.send_each_for_multicast = lambda m: _Resp(len(m.tokens))
+    services.print = lambda *a, **k: None
+    db = services.db
+
+    def notify(sender, chat_id):
+        reads = db.op_counts()["reads"]
+        with request_accounting() as stats:
+            services.send_push_notification(sender, chat_id, "bench")
+        # se descuenta la lectura del documento del chat
+        return stats.calls - 1, db.op_counts()["reads"] - reads - 1
+
+    print(f"{'miembros':>9} {'antes (gets)':>13} {'round-trips':>12} {'docs leídos':>12} {'2ª notif.':>10}")
+    for members in (2, 50, 500):
+        users = [f"usr{i:04d}" for i in range(members)]
+        chat_id = f"chat-{members}"
+        db.collection(COLL_CHATS).document(chat_id).set({"project_id": "bench", "type": "group", "users": users})
+        for u in users:
+            db.collection(COLL_FCM_TOKENS).document(u).set({"token": f"tok-{u}"})
+        services._token_cache.clear()
+
+        trips, docs = notify(users[0], chat_id)
+        warm, _ = notify(users[0], chat_id)
+        print(f"{members:>9} {members - 1:>13} {trips:>12} {docs:>12} {warm:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Benchmark de serialización de respuestas con 10.000 mensajes.
+
+Compara el camino anterior (jsonable_encoder + JSONResponse de FastAPI) con el actual
+(WireResponse / orjson de serializers.py), con y sin proyección de campos, sobre una
+página de mensajes como la que devuelve list_messages (fechas DatetimeWithNanoseconds).
+Reporta tiempo por respuesta (mejor de --repeat), tamaño del cuerpo y memoria pico
+reservada durante la serialización (tracemalloc).
+
+Uso:
+    python benchmarks/bench_serialization.py [--messages 10000] [--repeat 5]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+from datetime import timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from google.cloud.firestore_v1._helpers import DatetimeWithNanoseconds
+
+from serializers import WireResponse, project
+
+
+def make_page(n):
+    base = DatetimeWithNanoseconds(2024, 1, 1, tzinfo=timezone.utc)
+    messages = [{
+        "id": f"msg{i:06d}",
+        "chat_id": "chat-bench",
+        "sender_id": f"usr{i % 20:04d}",
+        "text": f"mensaje de prueba número {i} con algo de texto ñ",
+        "timestamp": base + timedelta(seconds=i),
+    } for i in range(n)]
+    return {"messages": messages, "next_cursor": "eyJ0cyI6IjIwMjQifQ", "next_cursor_param": "after", "has_more": True}
+
+
+def before(page):
+    return JSONResponse(jsonable_encoder(page)).body
+
+
+def after(page):
+    return WireResponse(page).body
+
+
+def after_projected(page):
+    return WireResponse({**page, "messages": project(page["messages"], ("id", "text", "timestamp"))}).body
+
+
+def measure(fn, page, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        body = fn(page)
+        best = min(best, time.perf_counter() - t0)
+    tracemalloc.start()
+    fn(page)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"ms": best * 1000, "bytes": len(body), "peak_kb": peak / 1024}
+
+
+def main(args):
+    page = make_page(args.messages)
+    # Mismo contenido por los dos caminos (el orden/espaciado del JSON puede variar)
+    assert json.loads(before(page)) == json.loads(after(page))
+    rows = [
+        ("jsonable_encoder + JSONResponse", measure(before, page, args.repeat)),
+        ("WireResponse (orjson)", measure(after, page, args.repeat)),
+        ("WireResponse + fields=id,text,timestamp", measure(after_projected, page, args.repeat)),
+    ]
+    print(f"{args.messages} mensajes")
+    print(f"{'camino':<42} {'ms':>9} {'cuerpo KB':>10} {'pico KB':>10}")
+    for name, r in rows:
+        print(f"{name:<42} {r['ms']:>9.2f} {r['bytes'] / 1024:>10.1f} {r['peak_kb']:>10.1f}")
+    print(f"\nAceleración: x{rows[0][1]['ms'] / rows[1][1]['ms']:.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    main(parser.parse_args())
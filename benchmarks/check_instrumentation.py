@@ -0,0 +1,88 @@
+"""
+Chequeo del proxy de instrumentation.py contra los tipos reales de google-cloud-firestore.
+
+Query.stream() devuelve StreamGenerator y AsyncQuery.stream() AsyncStreamGenerator (no son
+generadores nativos). Se envuelve un cliente falso cuyas consultas devuelven esos tipos y
+se verifica que el proxy los itere igual que el cliente real y cuente las lecturas, también
+cuando el consumidor corta la iteración antes del final.
+
+Uso:
+    python benchmarks/check_instrumentation.py    # termina con código 1 si algo falla
+"""
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from google.cloud.firestore_v1.async_stream_generator import AsyncStreamGenerator
+from google.cloud.firestore_v1.stream_generator import StreamGenerator
+
+from instrumentation import instrument, request_accounting
+
+DOCS = ["a", "b", "c"]
+
+
+class _Query:
+    def where(self, *args, **kw):
+        return self
+
+    def stream(self, transaction=None):
+        def gen():
+            yield from DOCS
+        return StreamGenerator(gen())
+
+
+class _AsyncQuery(_Query):
+    def stream(self, transaction=None):
+        async def gen():
+            for d in DOCS:
+                yield d
+        return AsyncStreamGenerator(gen())
+
+
+class _Client:
+    def __init__(self, query_cls):
+        self._query_cls = query_cls
+
+    def collection(self, name):
+        return self._query_cls()
+
+
+def check_sync():
+    client = instrument(_Client(_Query))
+    with request_accounting() as stats:
+        docs = list(client.collection("chats").where("x", "==", 1).stream())
+    assert docs == DOCS, docs
+    assert (stats.reads, stats.queries) == (len(DOCS), 1), stats.as_dict()
+
+    # Cortar la iteración antes del final también registra la consulta (con lo leído)
+    with request_accounting() as stats:
+        for _ in client.collection("chats").where("x", "==", 1).stream():
+            break
+    assert (stats.reads, stats.queries) == (1, 1), stats.as_dict()
+
+
+async def check_async():
+    client = instrument(_Client(_AsyncQuery))
+    with request_accounting() as stats:
+        docs = [d async for d in client.collection("chats").where("x", "==", 1).stream()]
+    assert docs == DOCS, docs
+    assert (stats.reads, stats.queries) == (len(DOCS), 1), stats.as_dict()
+
+    with request_accounting() as stats:
+        stream = client.collection("chats").where("x", "==", 1).stream()
+        async for _ in stream:
+            break
+        await stream.aclose()
+    assert (stats.reads, stats.queries) == (1, 1), stats.as_dict()
+
+
+def main():
+    check_sync()
+    asyncio.run(check_async())
+    print("ok: StreamGenerator y AsyncStreamGenerator pasan por el proxy")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Prueba de carga con muchas conexiones concurrentes contra un servidor en ejecución.
+
+Mide p50/p99 de GET /chats/{chat_id}/messages (y opcionalmente POST de mensajes).
+Para comparar la API sync con la async, correr el mismo comando contra el servidor
+levantado en cada versión (por ejemplo con `git stash`/`git checkout` del commit anterior).
+
+Uso:
+    uvicorn main:app --port 8000
+    python benchmarks/load_concurrency.py --url http://localhost:8000 \\
+        --project <uuid> --api-key <key> --chat <chat_id> --concurrency 1000 --requests 20000 [--post]
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = min(len(values) - 1, max(0, int(round(p / 100 * (len(values) - 1)))))
+    return values[k]
+
+
+async def run(args):
+    headers = {"X-Project-Id": args.project, "X-Api-Key": args.api_key}
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    latencies, errors = [], 0
+    remaining = args.requests
+
+    async with httpx.AsyncClient(base_url=args.url, headers=headers, limits=limits, timeout=60) as client:
+        async def worker(n):
+            nonlocal remaining, errors
+            while remaining > 0:
+                remaining -= 1
+                start = time.perf_counter()
+                try:
+                    if args.post:
+                        r = await client.post(f"/chats/{args.chat}/messages",
+                                              json={"sender_id": "bench", "text": f"msg {n}"})
+                    else:
+                        r = await client.get(f"/chats/{args.chat}/messages", params={"limit": args.limit})
+                    if r.status_code >= 400:
+                        errors += 1
+                except httpx.HTTPError:
+                    errors += 1
+                latencies.append((time.perf_counter() - start) * 1000)
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*(worker(i) for i in range(args.concurrency)))
+        elapsed = time.perf_counter() - t0
+
+    print(f"peticiones: {len(latencies)}  errores: {errors}  tiempo: {elapsed:.2f}s  rps: {len(latencies) / elapsed:.1f}")
+    print(f"p50: {percentile(latencies, 50):.1f} ms  p99: {percentile(latencies, 99):.1f} ms  "
+          f"media: {statistics.fmean(latencies):.1f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--project", required=True)
+    parser.add_argument("--api-key", required=True)
+    parser.add_argument("--chat", required=True)
+    parser.add_argument("--concurrency", type=int, default=1000)
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--limit", type=int, default=50)
+    parser.add_argument("--post", action="store_true")
+    asyncio.run(run(parser.parse_args()))
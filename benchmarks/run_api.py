@@ -0,0 +1,204 @@
+"""
+Suite de benchmarks de la API contra el backend en memoria (STORAGE_BACKEND=memory).
+
+Escenarios: envío de mensajes, historial, creación de chats, inbox y páginas HTML de admin.
+Reporta throughput, latencias p50/p95/p99 y, en modo in-process, lecturas/escrituras
+de Firestore por operación (contadas por memory_db como las factura Firestore).
+
+Uso:
+    python benchmarks/run_api.py                          # in-process (ASGI)
+    python benchmarks/run_api.py --mode uvicorn           # servidor real en un subproceso
+    python benchmarks/run_api.py --save local             # guarda benchmarks/baselines/local.json
+    python benchmarks/run_api.py --compare local          # compara contra una línea base
+
+Con --compare el proceso termina con código 1 si algún escenario empeora más que --tolerance.
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINES = os.path.join(ROOT, "benchmarks", "baselines")
+sys.path.insert(0, ROOT)
+os.environ["STORAGE_BACKEND"] = "memory"
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+async def seed(client, members, history):
+    project = (await client.post("/projects", json={"name": "bench"})).json()
+    headers = {"X-Project-Id": project["uuid"], "X-Api-Key": project["api_key"]}
+    users = [f"usr{i:04d}" for i in range(members)]
+    chat = (await client.post("/chats/group", json={"users": users, "title": "bench"}, headers=headers)).json()
+    for start in range(0, history, 500):
+        batch = [{"sender_id": users[i % members], "text": f"historial {i}"} for i in range(start, min(history, start + 500))]
+        await client.post(f"/chats/{chat['id']}/messages:batch", json={"messages": batch}, headers=headers)
+    # chats adicionales para que el inbox tenga contenido
+    for i in range(1, 20):
+        await client.post("/chats/direct", json={"users": [users[0], f"otro{i:03d}"]}, headers=headers)
+    return headers, chat["id"], users
+
+
+def scenarios(chat_id, users):
+    n = {"i": 0}
+
+    def send():
+        n["i"] += 1
+        return "POST", f"/chats/{chat_id}/messages", {"sender_id": users[n["i"] % len(users)], "text": f"bench {n['i']}"}
+
+    def create():
+        n["i"] += 1
+        return "POST", "/chats/group", {"users": [users[0], f"nuevo{n['i']}"], "title": "bench"}
+
+    return {
+        "message_send": send,
+        "history_fetch": lambda: ("GET", f"/chats/{chat_id}/messages?limit=50&newest_first=true", None),
+        "chat_create": create,
+        "inbox_list": lambda: ("GET", f"/chats?user_id={users[0]}&order=activity&limit=50", None),
+        # Las páginas de admin son estáticas: se mide la primera página de datos que cargan y el HTML de /mensajes
+        "admin_api_projects": lambda: ("GET", "/admin/api/projects?limit=50", None),
+        "admin_api_chats": lambda: ("GET", "/admin/api/chats?limit=50", None),
+        "admin_page_mensajes": lambda: ("GET", "/mensajes", None),
+    }
+
+
+async def run_scenario(client, headers, make_request, requests, concurrency, op_counts):
+    latencies, errors = [], 0
+    remaining = requests
+    before = op_counts() if op_counts else None
+
+    async def worker():
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            method, url, body = make_request()
+            start = time.perf_counter()
+            r = await client.request(method, url, json=body, headers=headers)
+            latencies.append((time.perf_counter() - start) * 1000)
+            if r.status_code >= 400:
+                errors += 1
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - t0
+
+    result = {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50), 2),
+        "p95_ms": round(percentile(latencies, 95), 2),
+        "p99_ms": round(percentile(latencies, 99), 2),
+    }
+    if op_counts:
+        after = op_counts()
+        for k in ("reads", "writes", "queries"):
+            result[f"{k}_per_op"] = round((after[k] - before[k]) / max(1, len(latencies)), 2)
+    return result
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def main(args):
+    proc = None
+    op_counts = None
+    if args.mode == "inprocess":
+        import main as app_module
+        import services
+        transport = httpx.ASGITransport(app=app_module.app)
+        client = httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60)
+        op_counts = services.db.op_counts
+    else:
+        port = free_port()
+        env = dict(os.environ, STORAGE_BACKEND="memory")
+        proc = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+                                cwd=ROOT, env=env)
+        client = httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=60,
+                                   limits=httpx.Limits(max_connections=args.concurrency))
+        for _ in range(100):
+            try:
+                await client.get("/stats/auth-cache")
+                break
+            except httpx.HTTPError:
+                await asyncio.sleep(0.1)
+
+    try:
+        headers, chat_id, users = await seed(client, args.members, args.history)
+        results = {}
+        for name, make_request in scenarios(chat_id, users).items():
+            if args.only and name not in args.only:
+                continue
+            requests = args.requests if not name.startswith("admin") else max(1, args.requests // 10)
+            results[name] = await run_scenario(client, headers, make_request, requests, args.concurrency, op_counts)
+    finally:
+        await client.aclose()
+        if proc:
+            proc.terminate()
+            proc.wait()
+
+    print(f"{'escenario':<20} {'req':>6} {'err':>4} {'rps':>9} {'p50':>8} {'p95':>8} {'p99':>8} {'reads':>7} {'writes':>7}")
+    for name, r in results.items():
+        print(f"{name:<20} {r['requests']:>6} {r['errors']:>4} {r['rps']:>9} {r['p50_ms']:>8} {r['p95_ms']:>8} "
+              f"{r['p99_ms']:>8} {r.get('reads_per_op', '-'):>7} {r.get('writes_per_op', '-'):>7}")
+
+    report = {"mode": args.mode, "concurrency": args.concurrency, "members": args.members,
+              "history": args.history, "results": results}
+    if args.save:
+        os.makedirs(BASELINES, exist_ok=True)
+        with open(os.path.join(BASELINES, f"{args.save}.json"), "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Línea base guardada en benchmarks/baselines/{args.save}.json")
+    if args.compare:
+        return compare(report, args.compare, args.tolerance)
+    return 0
+
+
+def compare(report, name, tolerance):
+    with open(os.path.join(BASELINES, f"{name}.json")) as f:
+        base = json.load(f)
+    regressions = 0
+    print(f"\nComparación contra {name} (tolerancia {tolerance:.0%}):")
+    for scen, cur in report["results"].items():
+        old = base["results"].get(scen)
+        if not old:
+            continue
+        notes = []
+        if cur["p50_ms"] > old["p50_ms"] * (1 + tolerance):
+            notes.append(f"p50 {old['p50_ms']} -> {cur['p50_ms']} ms")
+        # Las lecturas/escrituras por operación son deterministas: cualquier aumento es regresión
+        for k in ("reads_per_op", "writes_per_op"):
+            if k in cur and k in old and cur[k] > old[k]:
+                notes.append(f"{k} {old[k]} -> {cur[k]}")
+        regressions += bool(notes)
+        print(f"  {scen:<20} {'REGRESIÓN: ' + ', '.join(notes) if notes else 'ok'}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mode", choices=["inprocess", "uvicorn"], default="inprocess")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--members", type=int, default=20)
+    parser.add_argument("--history", type=int, default=2000)
+    parser.add_argument("--only", nargs="*")
+    parser.add_argument("--save")
+    parser.add_argument("--compare")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,78 @@
+from __future__ import annotations
+from typing import Any, Dict, Hashable, Optional
+from collections import OrderedDict
+import threading
+import time
+
+
+# Marcador para distinguir "no está en cache" de un valor None cacheado
+MISSING = object()
+
+
+class TTLCache:
+    """
+    Cache en memoria con expiración (TTL) y desalojo LRU, segura entre hilos.
+    Permite guardar resultados negativos (por ejemplo None) con un TTL propio.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = 60.0, negative_ttl: Optional[float] = None):
+        self.max_size = max(1, int(max_size))
+        self.ttl = float(ttl)
+        self.negative_ttl = float(ttl if negative_ttl is None else negative_ttl)
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, default: Any = MISSING):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, expires_at = entry
+            if expires_at <= now:
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        if ttl is None:
+            ttl = self.negative_ttl if value is None else self.ttl
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": (self.hits / total) if total else 0.0,
+            }
@@ -34,4 +34,132 @@ COLL_FCM_TOKENS = "fcm_tokens"
 
 
 # Agrega esta línea para cargar el messagingSenderId desde el .env
-FIREBASE_MESSAGING_SENDER_ID = os.getenv("FIREBASE_MESSAGING_SENDER_ID")
\ No newline at end of file
+FIREBASE_MESSAGING_SENDER_ID = os.getenv("FIREBASE_MESSAGING_SENDER_ID")
+
+# Cache de credenciales de proyecto (require_project_auth)
+# TTL en segundos; las API keys inválidas / proyectos inexistentes usan AUTH_CACHE_NEGATIVE_TTL
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "60"))
+AUTH_CACHE_NEGATIVE_TTL = float(os.getenv("AUTH_CACHE_NEGATIVE_TTL", "10"))
+AUTH_CACHE_MAX_SIZE = int(os.getenv("AUTH_CACHE_MAX_SIZE", "1024"))
+
+
+# Cola de notificaciones push en segundo plano
+NOTIF_WORKERS = int(os.getenv("NOTIF_WORKERS", "2"))
+NOTIF_QUEUE_MAX = int(os.getenv("NOTIF_QUEUE_MAX", "1000"))
+NOTIF_ENQUEUE_TIMEOUT = float(os.getenv("NOTIF_ENQUEUE_TIMEOUT", "0.05"))
+NOTIF_DRAIN_TIMEOUT = float(os.getenv("NOTIF_DRAIN_TIMEOUT", "10"))
+
+
+# Resolución de tokens FCM: lecturas agrupadas (get_all) y cache por user_id
+FCM_TOKEN_BATCH_SIZE = int(os.getenv("FCM_TOKEN_BATCH_SIZE", "100"))
+FCM_TOKEN_CACHE_TTL = float(os.getenv("FCM_TOKEN_CACHE_TTL", "300"))
+FCM_TOKEN_CACHE_NEGATIVE_TTL = float(os.getenv("FCM_TOKEN_CACHE_NEGATIVE_TTL", "60"))
+FCM_TOKEN_CACHE_MAX_SIZE = int(os.getenv("FCM_TOKEN_CACHE_MAX_SIZE", "10000"))
+# Máximo de tokens por envío multicast permitido por FCM
+FCM_MULTICAST_LIMIT = 500
+
+
+# Paginación de mensajes
+MESSAGES_PAGE_DEFAULT = int(os.getenv("MESSAGES_PAGE_DEFAULT", "50"))
+MESSAGES_PAGE_MAX = int(os.getenv("MESSAGES_PAGE_MAX", "500"))
+
+
+# Paginación de chats (GET /chats)
+CHATS_PAGE_DEFAULT = int(os.getenv("CHATS_PAGE_DEFAULT", "50"))
+CHATS_PAGE_MAX = int(os.getenv("CHATS_PAGE_MAX", "500"))
+
+
+# Largo máximo del texto guardado en chats.last_message.text
+LAST_MESSAGE_PREVIEW_CHARS = int(os.getenv("LAST_MESSAGE_PREVIEW_CHARS", "120"))
+
+
+# Chats directos con id determinístico. Mientras existan chats directos con id aleatorio
+# (antes de correr migrate_direct_chats.py) se mantiene la búsqueda por pair_key como respaldo.
+DIRECT_CHAT_LEGACY_LOOKUP = os.getenv("DIRECT_CHAT_LEGACY_LOOKUP", "1") == "1"
+
+
+# Entrega en tiempo real (WebSocket)
+REALTIME_BUFFER_SIZE = int(os.getenv("REALTIME_BUFFER_SIZE", "100"))
+REALTIME_SEND_TIMEOUT = float(os.getenv("REALTIME_SEND_TIMEOUT", "5"))
+# Escuchar en Firestore (on_snapshot) los mensajes escritos por otros workers/procesos
+REALTIME_FIRESTORE_LISTENER = os.getenv("REALTIME_FIRESTORE_LISTENER", "0") == "1"
+
+# Server-Sent Events: intervalo de keepalive y máximo de mensajes reenviados al reanudar
+SSE_HEARTBEAT_SECONDS = float(os.getenv("SSE_HEARTBEAT_SECONDS", "15"))
+SSE_RESUME_MAX = int(os.getenv("SSE_RESUME_MAX", "500"))
+
+
+# Sincronización (POST /sync): chats revisados por llamada y mensajes por chat
+SYNC_MAX_CHATS = int(os.getenv("SYNC_MAX_CHATS", "100"))
+SYNC_PER_CHAT_DEFAULT = int(os.getenv("SYNC_PER_CHAT_DEFAULT", "100"))
+
+
+# Contadores de no leídos (chats.unread_counts): cada mensaje suma un Increment por miembro y
+# Firestore admite 500 transformaciones por documento en un commit. Los chats con
+# UNREAD_COUNTERS_MAX_MEMBERS miembros o más no llevan contadores: los no leídos se calculan
+# con count() sobre los mensajes posteriores al cursor de lectura.
+UNREAD_COUNTERS_MAX_MEMBERS = int(os.getenv("UNREAD_COUNTERS_MAX_MEMBERS", "100"))
+
+
+# Ingesta de mensajes en lote
+BATCH_MESSAGES_MAX = int(os.getenv("BATCH_MESSAGES_MAX", "500"))
+# Límite de operaciones por WriteBatch de Firestore
+FIRESTORE_BATCH_LIMIT = 500
+
+
+# Backend de almacenamiento: "firestore" (por defecto) o "memory" (local, sin proyecto de Firebase)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "firestore").lower()
+# Envío real de notificaciones FCM (desactivado por defecto con el backend en memoria)
+FCM_ENABLED = os.getenv("FCM_ENABLED", "0" if STORAGE_BACKEND == "memory" else "1") == "1"
+
+
+# Contabilidad de operaciones de Firestore por petición (instrumentation.py)
+FIRESTORE_INSTRUMENTATION = os.getenv("FIRESTORE_INSTRUMENTATION", "1") == "1"
+# Agrega las cabeceras X-Firestore-* a cada respuesta (solo para depuración)
+FIRESTORE_DEBUG_HEADERS = os.getenv("FIRESTORE_DEBUG_HEADERS", "0") == "1"
+# Lecturas por petición a partir de las cuales se registra una advertencia (0 = sin límite)
+FIRESTORE_READ_BUDGET = int(os.getenv("FIRESTORE_READ_BUDGET", "200"))
+
+
+# Profiler por muestreo (profiling.py). Con PROFILE_ADMIN_TOKEN definido, una petición con
+# "X-Profile: 1" y "X-Admin-Token: <token>" se perfila; PROFILE_SAMPLE_RATE perfila al azar
+# esa fracción de las peticiones (0 = ninguna). Los perfiles se descargan en /admin/profiles.
+PROFILE_ADMIN_TOKEN = os.getenv("PROFILE_ADMIN_TOKEN", "")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "20"))
+PROFILE_MAX_CONCURRENT = int(os.getenv("PROFILE_MAX_CONCURRENT", "2"))
+
+
+# Listados JSON de las páginas de admin (/admin/api/*): tamaño de página y, al buscar,
+# documentos revisados por lectura y como máximo por llamada
+ADMIN_PAGE_DEFAULT = int(os.getenv("ADMIN_PAGE_DEFAULT", "50"))
+ADMIN_PAGE_MAX = int(os.getenv("ADMIN_PAGE_MAX", "200"))
+ADMIN_SCAN_BATCH = int(os.getenv("ADMIN_SCAN_BATCH", "200"))
+ADMIN_SCAN_MAX = int(os.getenv("ADMIN_SCAN_MAX", "2000"))
+
+
+# GET condicional de mensajes (http_cache.py): segundos desde el mensaje más reciente de una
+# página a partir de los cuales se considera que ya no cambia y se sirve como immutable
+HTTP_CACHE_SETTLE_SECONDS = float(os.getenv("HTTP_CACHE_SETTLE_SECONDS", "300"))
+
+
+# Exportación en streaming (NDJSON): documentos leídos por consulta y líneas por envío al cliente
+EXPORT_PAGE_SIZE = int(os.getenv("EXPORT_PAGE_SIZE", "500"))
+EXPORT_FLUSH_LINES = int(os.getenv("EXPORT_FLUSH_LINES", "100"))
+
+
+# Cache en proceso de los últimos mensajes de cada chat (recent_cache.py): mensajes por chat
+# y techo de memoria estimada para todos los chats (se desalojan los menos usados)
+RECENT_CACHE_ENABLED = os.getenv("RECENT_CACHE_ENABLED", "1") == "1"
+RECENT_CACHE_PER_CHAT = int(os.getenv("RECENT_CACHE_PER_CHAT", "100"))
+RECENT_CACHE_MAX_BYTES = int(os.getenv("RECENT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+
+# Commit agrupado de mensajes (group_commit.py). Con GROUP_COMMIT_ENABLED, POST /chats/{id}/messages
+# junta los mensajes de un mismo chat durante hasta GROUP_COMMIT_MAX_DELAY_MS (o hasta
+# GROUP_COMMIT_MAX_BATCH mensajes) y los escribe en un solo WriteBatch, con una sola
+# actualización del resumen del chat. La respuesta sale después del commit.
+GROUP_COMMIT_ENABLED = os.getenv("GROUP_COMMIT_ENABLED", "0") == "1"
+GROUP_COMMIT_MAX_DELAY_MS = float(os.getenv("GROUP_COMMIT_MAX_DELAY_MS", "5"))
+GROUP_COMMIT_MAX_BATCH = int(os.getenv("GROUP_COMMIT_MAX_BATCH", "100"))
@@ -11,17 +11,43 @@
 
 
 import firebase_admin
-from firebase_admin import credentials, firestore
+from firebase_admin import credentials, firestore, firestore_async
 # Importa la constante que creaste en config.py
-from config import FIREBASE_CREDENTIALS, FIREBASE_MESSAGING_SENDER_ID
+from config import FIREBASE_CREDENTIALS, FIREBASE_MESSAGING_SENDER_ID, STORAGE_BACKEND, FIRESTORE_INSTRUMENTATION
+from config import REALTIME_FIRESTORE_LISTENER
 
 # Agrega la importación del servicio de mensajería para notificaciones push
 from firebase_admin import messaging
 
-# Inicialización de Firebase
-cred = credentials.Certificate(FIREBASE_CREDENTIALS)
+if STORAGE_BACKEND == "memory":
+    # Backend en memoria (benchmarks / pruebas locales): no se inicializa Firebase
+    if REALTIME_FIRESTORE_LISTENER:
+        # El backend en memoria no tiene listeners (on_snapshot): todo pasa en un solo proceso
+        raise ValueError("REALTIME_FIRESTORE_LISTENER=1 requiere STORAGE_BACKEND=firestore")
+    from memory_db import MemoryClient, AsyncMemoryClient, transactional
 
-# Pasa la variable FIREBASE_MESSAGING_SENDER_ID
-firebase_admin.initialize_app(cred, {'messagingSenderId': FIREBASE_MESSAGING_SENDER_ID})
+    db = MemoryClient()
+    # Ambos clientes comparten los mismos datos
+    async_db = AsyncMemoryClient(db._store)
+elif STORAGE_BACKEND == "firestore":
+    from google.cloud.firestore_v1 import transactional
 
-db = firestore.client()
\ No newline at end of file
+    # Inicialización de Firebase
+    cred = credentials.Certificate(FIREBASE_CREDENTIALS)
+
+    # Pasa la variable FIREBASE_MESSAGING_SENDER_ID
+    firebase_admin.initialize_app(cred, {'messagingSenderId': FIREBASE_MESSAGING_SENDER_ID})
+
+    db = firestore.client()
+
+    # Cliente asíncrono (AsyncClient) para los endpoints async; `db` se mantiene para scripts y código sync
+    async_db = firestore_async.client()
+else:
+    raise ValueError(f"STORAGE_BACKEND inválido: {STORAGE_BACKEND}")
+
+if FIRESTORE_INSTRUMENTATION:
+    # Cuenta lecturas/escrituras/consultas y su latencia por petición (ver instrumentation.py)
+    from instrumentation import instrument
+
+    db = instrument(db)
+    async_db = instrument(async_db)
@@ -0,0 +1,121 @@
+"""
+Commit agrupado (group commit) de escrituras por clave, para el event loop de la API.
+
+Las escrituras que llegan para una misma clave (chat_id) se juntan durante como mucho
+`max_delay` segundos, o hasta `max_batch` elementos, y se confirman con una sola llamada a
+`commit(key, items)`. Cada submit() vuelve recién cuando terminó el commit que incluye su
+elemento (con el resultado que le corresponde, o la excepción del commit).
+
+Los commits de una misma clave se hacen en orden: si el anterior sigue en curso, el lote
+siguiente lo espera antes de confirmar.
+"""
+from __future__ import annotations
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional
+import asyncio
+import functools
+import threading
+import time
+
+
+class _Batch:
+    __slots__ = ("items", "futures", "timer")
+
+    def __init__(self):
+        self.items: List[Any] = []
+        self.futures: List[asyncio.Future] = []
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+
+class GroupCommitter:
+    def __init__(
+        self,
+        commit: Callable[[Hashable, List[Any]], Awaitable[List[Any]]],
+        max_delay: float = 0.005,
+        max_batch: int = 100,
+        on_flush: Optional[Callable[[int, str, float], Any]] = None,
+    ):
+        self.commit = commit
+        self.max_delay = max(0.0, float(max_delay))
+        self.max_batch = max(1, int(max_batch))
+        self.on_flush = on_flush
+        self._pending: Dict[Hashable, _Batch] = {}
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self._lock = threading.Lock()
+        self._metrics = {
+            "batches": 0,
+            "messages": 0,
+            "failed_batches": 0,
+            "flush_full": 0,
+            "flush_delay": 0,
+            "max_batch_seen": 0,
+        }
+
+    async def submit(self, key: Hashable, item: Any):
+        loop = asyncio.get_running_loop()
+        batch = self._pending.get(key)
+        if batch is None:
+            batch = self._pending[key] = _Batch()
+            batch.timer = loop.call_later(self.max_delay, self._flush, key, batch, "delay")
+        future = loop.create_future()
+        batch.items.append(item)
+        batch.futures.append(future)
+        if len(batch.items) >= self.max_batch:
+            self._flush(key, batch, "full")
+        return await future
+
+    def _flush(self, key: Hashable, batch: _Batch, reason: str):
+        if self._pending.get(key) is not batch:
+            return
+        del self._pending[key]
+        batch.timer.cancel()
+        previous = self._inflight.get(key)
+        task = asyncio.ensure_future(self._commit(key, batch, reason, previous))
+        self._inflight[key] = task
+        task.add_done_callback(functools.partial(self._done, key))
+
+    def _done(self, key: Hashable, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+
+    async def _commit(self, key: Hashable, batch: _Batch, reason: str, previous: Optional[asyncio.Task]):
+        if previous is not None:
+            await asyncio.wait([previous])
+        start = time.perf_counter()
+        try:
+            results = await self.commit(key, batch.items)
+        except Exception as e:
+            failed = True
+            for future in batch.futures:
+                # La petición pudo haberse cancelado (cliente desconectado) mientras esperaba
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            failed = False
+            for future, result in zip(batch.futures, results):
+                if not future.done():
+                    future.set_result(result)
+        elapsed = time.perf_counter() - start
+
+        size = len(batch.items)
+        with self._lock:
+            self._metrics["batches"] += 1
+            self._metrics["messages"] += size
+            self._metrics["failed_batches"] += failed
+            self._metrics[f"flush_{reason}"] += 1
+            self._metrics["max_batch_seen"] = max(self._metrics["max_batch_seen"], size)
+        if self.on_flush is not None:
+            try:
+                self.on_flush(size, reason, elapsed)
+            except Exception as e:
+                print(f"Error registrando métricas del commit agrupado: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            data = dict(self._metrics)
+        batches = data["batches"]
+        data["avg_batch"] = (data["messages"] / batches) if batches else 0.0
+        data["avg_fill_ratio"] = (data["avg_batch"] / self.max_batch) if batches else 0.0
+        data["max_batch"] = self.max_batch
+        data["max_delay_ms"] = self.max_delay * 1000
+        data["pending_keys"] = len(self._pending)
+        return data
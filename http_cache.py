@@ -0,0 +1,83 @@
+"""
+GET condicional (ETag / Last-Modified → 304) para las lecturas de chats y mensajes.
+
+Los validadores salen del documento del chat, que los endpoints ya leen para autenticar:
+- GET /chats/{id}: ETag con el hash del chat serializado (incluye read_cursors y
+  unread_counts, que cambian sin mover ninguna fecha, por eso no lleva Last-Modified).
+- GET /chats/{id}/messages: ETag con last_activity_at, message_count y los parámetros
+  de la consulta; Last-Modified = last_activity_at. Un 304 no lee la subcolección.
+  Una página puede cambiar mientras sus mensajes son recientes (escrituras concurrentes
+  con timestamps cercanos, ediciones, borrados): solo se sirve como immutable cuando su
+  mensaje más reciente es anterior a la ventana de asentamiento (HTTP_CACHE_SETTLE_SECONDS).
+  Las páginas hacia atrás (before=) con el cursor ya asentado llevan un ETag que depende
+  solo de los parámetros.
+"""
+from __future__ import annotations
+from typing import Any, Optional
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+import hashlib
+
+from fastapi import Request
+from fastapi.responses import Response
+
+# Datos autenticados: solo cachés privados (navegador / cliente)
+REVALIDATE = "private, no-cache"
+IMMUTABLE = "private, max-age=31536000, immutable"
+
+
+def make_etag(*parts: Any) -> str:
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(part if isinstance(part, bytes) else str(part).encode())
+        h.update(b"\0")
+    return f'"{h.hexdigest()[:32]}"'
+
+
+def http_date(dt: datetime) -> str:
+    return format_datetime(dt.astimezone(timezone.utc).replace(microsecond=0), usegmt=True)
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    if header.strip() == "*":
+        return True
+    # Comparación débil (RFC 9110 §13.1.2): se ignora el prefijo W/
+    tags = (t.strip() for t in header.split(","))
+    return any((t[2:] if t.startswith("W/") else t) == etag for t in tags)
+
+
+def not_modified(request: Request, etag: str, last_modified: Optional[datetime] = None) -> bool:
+    """If-None-Match tiene prioridad; If-Modified-Since solo se evalúa si no vino."""
+    inm = request.headers.get("if-none-match")
+    if inm is not None:
+        return _etag_matches(inm, etag)
+    ims = request.headers.get("if-modified-since")
+    if ims and last_modified is not None:
+        try:
+            since = parsedate_to_datetime(ims)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        return last_modified.replace(microsecond=0) <= since
+    return False
+
+
+def settled(newest: Optional[datetime], window: float) -> bool:
+    """True si `newest` (el mensaje más reciente de la página) ya salió de la ventana de asentamiento."""
+    if newest is None:
+        return False
+    if newest.tzinfo is None:
+        newest = newest.replace(tzinfo=timezone.utc)
+    return newest < datetime.now(timezone.utc) - timedelta(seconds=window)
+
+
+def cache_headers(etag: str, last_modified: Optional[datetime] = None, immutable: bool = False):
+    headers = {"ETag": etag, "Cache-Control": IMMUTABLE if immutable else REVALIDATE}
+    if last_modified is not None:
+        headers["Last-Modified"] = http_date(last_modified)
+    return headers
+
+
+def not_modified_response(headers) -> Response:
+    return Response(status_code=304, headers=headers)
@@ -0,0 +1,381 @@
+"""
+Contabilidad de operaciones de Firestore.
+
+instrument(client) envuelve el cliente (sync o async, Firestore o memory_db) y registra
+cada lectura, escritura y consulta con su latencia:
+- en el acumulador de la petición HTTP en curso (contextvar, ver request_accounting()),
+- en los totales globales por operación y colección (firestore_stats()),
+- y en los listeners registrados con add_listener() (por ejemplo métricas).
+
+Las lecturas se cuentan como las factura Firestore: un documento por get, los documentos
+devueltos por una consulta (mínimo uno) y una lectura por count().
+"""
+from __future__ import annotations
+from typing import Any, Callable, Dict, List, Optional
+from contextlib import contextmanager
+import contextvars
+import inspect
+import threading
+import time
+
+
+class RequestStats:
+    __slots__ = ("reads", "writes", "queries", "calls", "time_ms")
+
+    def __init__(self):
+        self.reads = 0
+        self.writes = 0
+        self.queries = 0
+        self.calls = 0
+        self.time_ms = 0.0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {"reads": self.reads, "writes": self.writes, "queries": self.queries,
+                "calls": self.calls, "time_ms": round(self.time_ms, 2)}
+
+
+_current: contextvars.ContextVar[Optional[RequestStats]] = contextvars.ContextVar("firestore_request_stats", default=None)
+_lock = threading.Lock()
+_totals: Dict[tuple, Dict[str, float]] = {}
+_routes: Dict[str, Dict[str, float]] = {}
+_listeners: List[Callable[[str, str, float, int, int], None]] = []
+
+
+@contextmanager
+def request_accounting():
+    """Acumula las operaciones hechas dentro del bloque (y de las tareas/hilos que hereden el contexto)."""
+    stats = RequestStats()
+    token = _current.set(stats)
+    try:
+        yield stats
+    finally:
+        _current.reset(token)
+
+
+def add_listener(fn: Callable[[str, str, float, int, int], None]):
+    """fn(op, collection, latency_seconds, reads, writes) se llama en cada operación."""
+    _listeners.append(fn)
+
+
+def record_request(route: str, stats: RequestStats):
+    """Suma las operaciones de una petición terminada a los totales de su ruta."""
+    with _lock:
+        t = _routes.get(route)
+        if t is None:
+            t = _routes[route] = {"requests": 0, "reads": 0, "writes": 0, "queries": 0, "max_reads": 0, "time_ms": 0.0}
+        t["requests"] += 1
+        t["reads"] += stats.reads
+        t["writes"] += stats.writes
+        t["queries"] += stats.queries
+        t["max_reads"] = max(t["max_reads"], stats.reads)
+        t["time_ms"] += stats.time_ms
+
+
+def _rounded(t: Dict[str, float]) -> Dict[str, Any]:
+    return {k: round(v, 2) if isinstance(v, float) else v for k, v in t.items()}
+
+
+def firestore_stats() -> Dict[str, Any]:
+    with _lock:
+        routes = {}
+        for route, t in sorted(_routes.items()):
+            out = routes[route] = _rounded(t)
+            out["reads_per_request"] = round(t["reads"] / t["requests"], 2)
+            out["writes_per_request"] = round(t["writes"] / t["requests"], 2)
+        return {
+            "operations": {f"{op} {coll}": _rounded(t) for (op, coll), t in sorted(_totals.items())},
+            "routes": routes,
+        }
+
+
+def _record(op: str, collection: str, started: float, reads: int = 0, writes: int = 0, query: bool = False):
+    elapsed = time.perf_counter() - started
+    stats = _current.get()
+    if stats is not None:
+        stats.reads += reads
+        stats.writes += writes
+        stats.queries += int(query)
+        stats.calls += 1
+        stats.time_ms += elapsed * 1000
+    with _lock:
+        t = _totals.get((op, collection))
+        if t is None:
+            t = _totals[(op, collection)] = {"calls": 0, "reads": 0, "writes": 0, "time_ms": 0.0}
+        t["calls"] += 1
+        t["reads"] += reads
+        t["writes"] += writes
+        t["time_ms"] += elapsed * 1000
+    for fn in _listeners:
+        try:
+            fn(op, collection, elapsed, reads, writes)
+        except Exception as e:
+            print(f"Error en listener de instrumentación: {e}")
+
+
+def _unwrap(obj):
+    return obj._wrapped if isinstance(obj, _Proxy) else obj
+
+
+def _measure(result, op: str, collection: str, started: float, reads: Callable[[Any], int] = lambda r: 0,
+             writes: int = 0, query: bool = False):
+    """Registra la operación; si el resultado es awaitable o iterable se registra al terminar."""
+    if inspect.isawaitable(result):
+        async def awaited():
+            value = await result
+            _record(op, collection, started, reads(value), writes, query)
+            return value
+        return awaited()
+    # AsyncQuery.stream() de google-cloud-firestore devuelve un AsyncStreamGenerator, que no es
+    # un async generator nativo: se reconoce por __aiter__ (antes que la rama sync de abajo)
+    if hasattr(result, "__aiter__"):
+        async def agen():
+            n = 0
+            # finally: si el consumidor corta antes (break, +1 de paginación) se registra lo leído
+            try:
+                async for item in result:
+                    n += 1
+                    yield item
+            finally:
+                _record(op, collection, started, max(1, n), writes, query)
+        return agen()
+    if inspect.isgenerator(result) or (query and not isinstance(result, list)):
+        def gen():
+            n = 0
+            try:
+                for item in result:
+                    n += 1
+                    yield item
+            finally:
+                _record(op, collection, started, max(1, n), writes, query)
+        return gen()
+    _record(op, collection, started, reads(result), writes, query)
+    return result
+
+
+class _Proxy:
+    __slots__ = ("_wrapped", "_collection")
+
+    def __init__(self, wrapped, collection: str = ""):
+        object.__setattr__(self, "_wrapped", wrapped)
+        object.__setattr__(self, "_collection", collection)
+
+    def __getattr__(self, name):
+        return getattr(self._wrapped, name)
+
+
+class _DocumentProxy(_Proxy):
+    __slots__ = ()
+
+    @property
+    def id(self):
+        return self._wrapped.id
+
+    def collection(self, name: str):
+        return _QueryProxy(self._wrapped.collection(name), name)
+
+    def get(self, transaction=None, **kw):
+        started = time.perf_counter()
+        if transaction is not None:
+            kw["transaction"] = _unwrap(transaction)
+        return _measure(self._wrapped.get(**kw), "get", self._collection, started, reads=lambda r: 1)
+
+    def _write(self, op, *args, **kw):
+        started = time.perf_counter()
+        return _measure(getattr(self._wrapped, op)(*args, **kw), op, self._collection, started, writes=1)
+
+    def set(self, *args, **kw):
+        return self._write("set", *args, **kw)
+
+    def create(self, *args, **kw):
+        return self._write("create", *args, **kw)
+
+    def update(self, *args, **kw):
+        return self._write("update", *args, **kw)
+
+    def delete(self, *args, **kw):
+        return self._write("delete", *args, **kw)
+
+
+class _AggregationProxy(_Proxy):
+    __slots__ = ()
+
+    def get(self, *args, **kw):
+        started = time.perf_counter()
+        if kw.get("transaction") is not None:
+            kw["transaction"] = _unwrap(kw["transaction"])
+        return _measure(self._wrapped.get(*args, **kw), "count", self._collection, started,
+                        reads=lambda r: 1, query=True)
+
+
+class _QueryProxy(_Proxy):
+    __slots__ = ()
+
+    def __getattr__(self, name):
+        attr = getattr(self._wrapped, name)
+        if name in ("where", "order_by", "limit", "limit_to_last", "start_after", "start_at", "end_before",
+                    "end_at", "select", "offset"):
+            return lambda *a, **kw: _QueryProxy(attr(*a, **kw), self._collection)
+        return attr
+
+    def document(self, *args, **kw):
+        return _DocumentProxy(self._wrapped.document(*args, **kw), self._collection)
+
+    def add(self, *args, **kw):
+        started = time.perf_counter()
+        result = self._wrapped.add(*args, **kw)
+
+        def wrap(r):
+            return r[0], _DocumentProxy(r[1], self._collection)
+
+        if inspect.isawaitable(result):
+            async def awaited():
+                value = await result
+                _record("add", self._collection, started, 0, 1)
+                return wrap(value)
+            return awaited()
+        _record("add", self._collection, started, 0, 1)
+        return wrap(result)
+
+    def stream(self, *args, **kw):
+        started = time.perf_counter()
+        return _measure(self._wrapped.stream(*args, **kw), "query", self._collection, started, query=True)
+
+    def get(self, *args, **kw):
+        started = time.perf_counter()
+        return _measure(self._wrapped.get(*args, **kw), "query", self._collection, started,
+                        reads=lambda r: max(1, len(r)), query=True)
+
+    def count(self, *args, **kw):
+        return _AggregationProxy(self._wrapped.count(*args, **kw), self._collection)
+
+    def on_snapshot(self, *args, **kw):
+        return self._wrapped.on_snapshot(*args, **kw)
+
+
+class _WriteProxy(_Proxy):
+    """WriteBatch / Transaction: cuenta escrituras al hacer commit."""
+    __slots__ = ("_pending", "_collections")
+
+    def __init__(self, wrapped):
+        super().__init__(wrapped, "")
+        object.__setattr__(self, "_pending", 0)
+        object.__setattr__(self, "_collections", set())
+
+    def _add(self, op, reference, *args, **kw):
+        object.__setattr__(self, "_pending", self._pending + 1)
+        if isinstance(reference, _Proxy):
+            self._collections.add(reference._collection)
+        return getattr(self._wrapped, op)(_unwrap(reference), *args, **kw)
+
+    def set(self, reference, *args, **kw):
+        return self._add("set", reference, *args, **kw)
+
+    def create(self, reference, *args, **kw):
+        return self._add("create", reference, *args, **kw)
+
+    def update(self, reference, *args, **kw):
+        return self._add("update", reference, *args, **kw)
+
+    def delete(self, reference, *args, **kw):
+        return self._add("delete", reference, *args, **kw)
+
+    def commit(self, *args, **kw):
+        started = time.perf_counter()
+        writes = self._pending
+        object.__setattr__(self, "_pending", 0)
+        collection = ",".join(sorted(c for c in self._collections if c)) or "-"
+        return _measure(self._wrapped.commit(*args, **kw), "commit", collection, started, writes=writes)
+
+    def _commit(self, *args, **kw):
+        # usado por google.cloud.firestore_v1.transactional
+        started = time.perf_counter()
+        writes = self._pending
+        object.__setattr__(self, "_pending", 0)
+        return _measure(self._wrapped._commit(*args, **kw), "commit", "transaction", started, writes=writes)
+
+
+class InstrumentedClient(_Proxy):
+    __slots__ = ()
+
+    def collection(self, name: str):
+        return _QueryProxy(self._wrapped.collection(name), name)
+
+    def batch(self, *args, **kw):
+        return _WriteProxy(self._wrapped.batch(*args, **kw))
+
+    def transaction(self, *args, **kw):
+        return _WriteProxy(self._wrapped.transaction(*args, **kw))
+
+    def get_all(self, references, *args, **kw):
+        refs = list(references)
+        collection = refs[0]._collection if refs and isinstance(refs[0], _Proxy) else "-"
+        started = time.perf_counter()
+        if "transaction" in kw:
+            kw["transaction"] = _unwrap(kw["transaction"])
+        result = self._wrapped.get_all([_unwrap(r) for r in refs], *args, **kw)
+        return _measure(result, "get_all", collection, started, reads=lambda r: len(refs), query=False) \
+            if not (inspect.isgenerator(result) or hasattr(result, "__aiter__")) \
+            else _measure_get_all(result, collection, started, len(refs))
+
+
+def _measure_get_all(result, collection: str, started: float, n: int):
+    if hasattr(result, "__aiter__"):
+        async def agen():
+            try:
+                async for item in result:
+                    yield item
+            finally:
+                _record("get_all", collection, started, n, 0)
+        return agen()
+
+    def gen():
+        try:
+            for item in result:
+                yield item
+        finally:
+            _record("get_all", collection, started, n, 0)
+    return gen()
+
+
+def instrument(client):
+    return InstrumentedClient(client)
+
+
+class FirestoreAccountingMiddleware:
+    """
+    Middleware ASGI: abre un acumulador por petición HTTP, suma el resultado a los totales
+    de la ruta, advierte si se supera `read_budget` lecturas y, con `debug_headers`,
+    agrega las cabeceras X-Firestore-Reads/Writes/Queries/Time-Ms a la respuesta.
+    """
+
+    def __init__(self, app, debug_headers: bool = False, read_budget: int = 0):
+        self.app = app
+        self.debug_headers = debug_headers
+        self.read_budget = read_budget
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start" and self.debug_headers:
+                headers = list(message.get("headers", []))
+                headers += [
+                    (b"x-firestore-reads", str(stats.reads).encode()),
+                    (b"x-firestore-writes", str(stats.writes).encode()),
+                    (b"x-firestore-queries", str(stats.queries).encode()),
+                    (b"x-firestore-time-ms", f"{stats.time_ms:.1f}".encode()),
+                ]
+                message = {**message, "headers": headers}
+            await send(message)
+
+        with request_accounting() as stats:
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                route = scope.get("route")
+                # Sin ruta (404): una sola clave fija, para que _routes no crezca con cada URL
+                route = f"{scope['method']} {getattr(route, 'path', None) or 'unmatched'}"
+                record_request(route, stats)
+                if self.read_budget and stats.reads > self.read_budget:
+                    print(f"Advertencia: {route} hizo {stats.reads} lecturas de Firestore (presupuesto {self.read_budget})")
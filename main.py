@@ -1,15 +1,32 @@
-import json
-from fastapi import FastAPI, HTTPException, Depends, Header
-from typing import Optional, List
-from fastapi.responses import HTMLResponse
+import os
+import asyncio
+from fastapi import FastAPI, HTTPException, Depends, Header, Query, WebSocket, WebSocketDisconnect, Request
+from typing import Optional, List, Dict
+from fastapi.responses import HTMLResponse, StreamingResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from services import (
-    create_project, list_projects, get_project, update_project, delete_project,
-    validate_project_auth, create_direct_chat, create_group_chat,
-    list_chats, get_chat, add_message, list_messages
+    create_project, get_project, update_project, delete_project,
+    create_direct_chat, create_group_chat,
+    admin_list_projects, admin_list_chats, auth_cache_stats,
+    start_notification_workers, stop_notification_workers, notification_queue_stats,
+    fcm_token_cache_stats, mark_chat_read, broker, realtime_stats, message_event, sync_user,
+    add_messages, add_messages_multi, recent_cache_stats, decode_cursor
 )
-from google.cloud.firestore_v1._helpers import DatetimeWithNanoseconds
+import async_services
+from realtime import SlowConsumer
+from static_assets import StaticAssets
+from http_cache import make_etag, not_modified, cache_headers, not_modified_response, settled, IMMUTABLE
+from serializers import WireResponse, WireRoute, dumps, parse_fields, project, ndjson, NDJSON
+from config import MESSAGES_PAGE_DEFAULT, MESSAGES_PAGE_MAX, CHATS_PAGE_DEFAULT, CHATS_PAGE_MAX
+from config import REALTIME_SEND_TIMEOUT, SSE_HEARTBEAT_SECONDS, SSE_RESUME_MAX
+from config import SYNC_MAX_CHATS, SYNC_PER_CHAT_DEFAULT, BATCH_MESSAGES_MAX
+from config import FIRESTORE_DEBUG_HEADERS, FIRESTORE_READ_BUDGET, ADMIN_PAGE_DEFAULT, ADMIN_PAGE_MAX
+from config import EXPORT_FLUSH_LINES, HTTP_CACHE_SETTLE_SECONDS
+from instrumentation import FirestoreAccountingMiddleware, firestore_stats
+import metrics
+from profiling import ProfileStore, ProfilingMiddleware, check_admin_token
+from config import PROFILE_ADMIN_TOKEN, PROFILE_SAMPLE_RATE, PROFILE_INTERVAL_MS, PROFILE_KEEP, PROFILE_MAX_CONCURRENT
 from datetime import datetime, timezone
 
 
@@ -18,7 +35,9 @@ class FCMToken(BaseModel):
     user_id: str
     fcm_token: str
 
-app = FastAPI(title="Chat API mínima")
+app = FastAPI(title="Chat API mínima", default_response_class=WireResponse)
+# Todas las rutas serializan su resultado con orjson (serializers.py)
+app.router.route_class = WireRoute
 
 # --- INICIO: Configuración de CORS ---
 # Esto permite que tu frontend (cliente de prueba) se comunique con tu backend
@@ -33,6 +52,27 @@ app.add_middleware(
 # --- FIN: Configuración de CORS ---
 
 
+# Contabilidad de operaciones de Firestore por petición (cabeceras X-Firestore-* en modo debug)
+app.add_middleware(FirestoreAccountingMiddleware, debug_headers=FIRESTORE_DEBUG_HEADERS, read_budget=FIRESTORE_READ_BUDGET)
+# Métricas Prometheus (GET /metrics)
+app.add_middleware(metrics.PrometheusMiddleware)
+# Profiler bajo demanda (X-Profile + X-Admin-Token, o una fracción de las peticiones al azar)
+profiles = ProfileStore(PROFILE_KEEP)
+app.add_middleware(ProfilingMiddleware, store=profiles, admin_token=PROFILE_ADMIN_TOKEN,
+                   sample_rate=PROFILE_SAMPLE_RATE, interval=PROFILE_INTERVAL_MS / 1000,
+                   max_concurrent=PROFILE_MAX_CONCURRENT)
+
+
+# Workers de notificaciones push: arrancan con la app y drenan la cola al apagarse
+@app.on_event("startup")
+def on_startup():
+    start_notification_workers()
+
+@app.on_event("shutdown")
+def on_shutdown():
+    stop_notification_workers()
+
+
 
 # Schemas
 class ProjectIn(BaseModel):
@@ -52,27 +92,70 @@ class MessageIn(BaseModel):
     sender_id: str
     text: str
 
+class MessageBatchIn(BaseModel):
+    messages: List[MessageIn] = Field(..., min_length=1, max_length=BATCH_MESSAGES_MAX)
+
+class MultiChatMessageIn(MessageIn):
+    chat_id: str
+
+class MultiChatMessageBatchIn(BaseModel):
+    messages: List[MultiChatMessageIn] = Field(..., min_length=1, max_length=BATCH_MESSAGES_MAX)
+
+class ReadCursorIn(BaseModel):
+    user_id: str
+    message_id: Optional[str] = None
+
+class SyncIn(BaseModel):
+    user_id: str
+    cursors: Dict[str, Optional[str]] = {}
+    since: Optional[datetime] = None
+    per_chat_limit: int = Field(SYNC_PER_CHAT_DEFAULT, ge=1, le=MESSAGES_PAGE_MAX)
+    continuation: Optional[str] = None
+
 # Dependency para validar auth
-def require_project_auth(
+async def require_project_auth(
     x_project_id: str = Header(..., alias="X-Project-Id"),
     x_api_key: str = Header(..., alias="X-Api-Key"),
 ):
-    if not validate_project_auth(x_project_id, x_api_key):
+    if not await async_services.validate_project_auth(x_project_id, x_api_key):
         raise HTTPException(status_code=401, detail="Proyecto inválido o API key incorrecta")
     return x_project_id
 
+# Dependency para endpoints de un chat: valida auth y lee el chat en paralelo
+async def require_chat_auth(
+    chat_id: str,
+    x_project_id: str = Header(..., alias="X-Project-Id"),
+    x_api_key: str = Header(..., alias="X-Api-Key"),
+):
+    ok, chat = await asyncio.gather(
+        async_services.validate_project_auth(x_project_id, x_api_key),
+        async_services.get_chat(chat_id),
+    )
+    if not ok:
+        raise HTTPException(status_code=401, detail="Proyecto inválido o API key incorrecta")
+    if not chat or chat["project_id"] != x_project_id:
+        raise HTTPException(404, "Chat no encontrado")
+    return chat
+
 # ---- Projects ----
 @app.post("/projects")
 def http_create_project(data: ProjectIn):
     return create_project(data.name)
 
 @app.get("/projects")
-def http_list_projects():
-    return list_projects()
+async def http_list_projects(fields: Optional[str] = Query(None, description="Campos a devolver, separados por coma")):
+    return project(await async_services.list_projects(), parse_fields(fields))
+
+@app.get("/projects/{pid}/export")
+async def http_export_project(pid: str, project_id: str = Depends(require_project_auth)):
+    """Exporta en NDJSON los chats del proyecto, cada uno seguido de sus mensajes."""
+    if pid != project_id:
+        raise HTTPException(403, "Solo se puede exportar el proyecto autenticado")
+    return ndjson_response(async_services.stream_project(pid), f"project-{pid}.ndjson")
 
 @app.get("/projects/{pid}")
-def http_get_project(pid: str):
-    pr = get_project(pid)
+async def http_get_project(pid: str):
+    pr = await async_services.get_project(pid)
     if not pr: raise HTTPException(404, "Proyecto no encontrado")
     return pr
 
@@ -88,10 +171,73 @@ def http_delete_project(pid: str):
     delete_project(pid)
     return {"ok": True}
 
+# ---- Stats ----
+@app.get("/stats/auth-cache")
+def http_auth_cache_stats():
+    return auth_cache_stats()
+
+@app.get("/stats/notifications")
+def http_notification_queue_stats():
+    return notification_queue_stats()
+
+@app.get("/stats/fcm-token-cache")
+def http_fcm_token_cache_stats():
+    return fcm_token_cache_stats()
+
+@app.get("/stats/realtime")
+def http_realtime_stats():
+    return realtime_stats()
+
+@app.get("/stats/recent-messages-cache")
+def http_recent_cache_stats():
+    return recent_cache_stats()
+
+@app.get("/stats/group-commit")
+def http_group_commit_stats():
+    return async_services.group_commit_stats()
+
+@app.get("/stats/firestore")
+def http_firestore_stats():
+    return firestore_stats()
+
+# ---- Profiles (admin) ----
+def require_admin(x_admin_token: str = Header(..., alias="X-Admin-Token")):
+    if not check_admin_token(PROFILE_ADMIN_TOKEN, x_admin_token):
+        raise HTTPException(status_code=401, detail="Token de admin inválido")
+
+@app.get("/admin/profiles", dependencies=[Depends(require_admin)])
+def http_list_profiles():
+    return profiles.list()
+
+@app.get("/admin/profiles/{profile_id}", dependencies=[Depends(require_admin)])
+def http_get_profile(profile_id: str):
+    profile = profiles.get(profile_id)
+    if not profile: raise HTTPException(404, "Perfil no encontrado")
+    # Formato "collapsed stacks": flamegraph.pl, speedscope o inferno lo leen directamente
+    return Response(content=profile["collapsed"], media_type="text/plain",
+                    headers={"Content-Disposition": f'attachment; filename="profile-{profile_id}.folded"'})
+
+@app.get("/metrics", include_in_schema=False)
+def http_metrics():
+    body, content_type = metrics.render()
+    return Response(content=body, media_type=content_type)
+
 # ---- Chats ----
 @app.get("/chats")
-def http_list_chats(project_id: str = Depends(require_project_auth)):
-    return list_chats(project_id)
+async def http_list_chats(
+    user_id: Optional[str] = None,
+    limit: int = Query(CHATS_PAGE_DEFAULT, ge=1, le=CHATS_PAGE_MAX),
+    cursor: Optional[str] = None,
+    order: str = Query("created", pattern="^(created|activity)$"),
+    fields: Optional[str] = Query(None, description="Campos a devolver, separados por coma"),
+    project_id: str = Depends(require_project_auth),
+):
+    try:
+        page = await async_services.list_chats(project_id, user_id=user_id, limit=limit, cursor=cursor, order=order)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    page["chats"] = project(page["chats"], parse_fields(fields))
+    return page
 
 @app.post("/chats/direct")
 def http_create_direct_chat(data: ChatDirectIn, project_id: str = Depends(require_project_auth)):
@@ -106,677 +252,273 @@ def http_create_group_chat(data: ChatGroupIn, project_id: str = Depends(require_
     return create_group_chat(project_id, data.users, data.title)
 
 @app.get("/chats/{chat_id}")
-def http_get_chat(chat_id: str, project_id: str = Depends(require_project_auth)):
-    chat = get_chat(chat_id)
-    if not chat or chat["project_id"] != project_id:
-        raise HTTPException(404, "Chat no encontrado")
-    return chat
+async def http_get_chat(request: Request, chat: dict = Depends(require_chat_auth)):
+    body = dumps(chat)
+    headers = cache_headers(make_etag(body))
+    if not_modified(request, headers["ETag"]):
+        return not_modified_response(headers)
+    return Response(content=body, media_type="application/json", headers=headers)
 
 # ---- Messages ----
+def ndjson_response(items, filename: str):
+    return StreamingResponse(ndjson(items, EXPORT_FLUSH_LINES), media_type=NDJSON,
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
 @app.get("/chats/{chat_id}/messages")
-def http_list_messages(chat_id: str, project_id: str = Depends(require_project_auth)):
-    chat = get_chat(chat_id)
-    if not chat or chat["project_id"] != project_id:
-        raise HTTPException(404, "Chat no encontrado")
-    return list_messages(chat_id)
+async def http_list_messages(
+    request: Request,
+    chat_id: str,
+    limit: int = Query(MESSAGES_PAGE_DEFAULT, ge=1, le=MESSAGES_PAGE_MAX),
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    newest_first: bool = False,
+    fields: Optional[str] = Query(None, description="Campos a devolver, separados por coma"),
+    stream: bool = Query(False, description="Exportar como NDJSON en streaming (igual que Accept: application/x-ndjson)"),
+    chat: dict = Depends(require_chat_auth),
+):
+    # Streaming: todo el historial desde el cursor (o hasta `limit` si se pasa explícitamente)
+    if stream or NDJSON in request.headers.get("accept", ""):
+        try:
+            messages = async_services.stream_messages(chat_id, before=before, after=after, newest_first=newest_first,
+                                                      limit=limit if "limit" in request.query_params else None)
+        except ValueError as e:
+            raise HTTPException(400, str(e))
+        projection = parse_fields(fields)
+        if projection:
+            messages = (project(m, projection) async for m in messages)
+        return ndjson_response(messages, f"chat-{chat_id}.ndjson")
+
+    # GET condicional con los datos del chat ya leído: un 304 no consulta la subcolección.
+    # Una página hacia atrás (before=) solo tiene mensajes anteriores al cursor: si el cursor
+    # ya está asentado la página no cambia y su ETag depende solo de los parámetros.
+    params = sorted(request.query_params.multi_items())
+    try:
+        frozen = bool(before) and settled(decode_cursor(before)[0], HTTP_CACHE_SETTLE_SECONDS)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    activity = None
+    if frozen:
+        headers = cache_headers(make_etag(chat_id, params), immutable=True)
+    else:
+        activity = chat.get("last_activity_at") or chat.get("created_at")
+        headers = cache_headers(make_etag(chat_id, activity, chat.get("message_count"), params), activity)
+    if not_modified(request, headers["ETag"], activity):
+        return not_modified_response(headers)
+
+    try:
+        page = await async_services.list_messages(chat_id, limit=limit, before=before, after=after,
+                                                  newest_first=newest_first, chat=chat)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    # Una página ascendente completa (hay más después) tampoco cambia, una vez asentado su último mensaje
+    if (page["has_more"] and page["next_cursor_param"] == "after"
+            and settled(page["messages"][-1].get("timestamp"), HTTP_CACHE_SETTLE_SECONDS)):
+        headers["Cache-Control"] = IMMUTABLE
+    page["messages"] = project(page["messages"], parse_fields(fields))
+    return WireResponse(page, headers=headers)
 
 @app.post("/chats/{chat_id}/messages")
-def http_add_message(chat_id: str, data: MessageIn, project_id: str = Depends(require_project_auth)):
-    chat = get_chat(chat_id)
+async def http_add_message(chat_id: str, data: MessageIn, chat: dict = Depends(require_chat_auth)):
+    return await async_services.add_message(chat_id, data.sender_id, data.text, chat=chat)
+
+@app.post("/chats/{chat_id}/messages:batch")
+def http_add_messages_batch(chat_id: str, data: MessageBatchIn, chat: dict = Depends(require_chat_auth)):
+    return {"results": add_messages(chat_id, [m.model_dump() for m in data.messages], chat=chat)}
+
+@app.post("/messages:batch")
+def http_add_messages_multi(data: MultiChatMessageBatchIn, project_id: str = Depends(require_project_auth)):
+    return {"results": add_messages_multi(project_id, [m.model_dump() for m in data.messages])}
+
+@app.post("/chats/{chat_id}/read")
+def http_mark_chat_read(chat_id: str, data: ReadCursorIn, chat: dict = Depends(require_chat_auth)):
+    if data.user_id not in chat.get("users", []):
+        raise HTTPException(403, "El usuario no pertenece al chat")
+    result = mark_chat_read(chat_id, data.user_id, data.message_id, chat=chat)
+    if result is None:
+        raise HTTPException(404, "Mensaje no encontrado")
+    return result
+
+# ---- Sync ----
+@app.post("/sync")
+def http_sync(data: SyncIn, project_id: str = Depends(require_project_auth)):
+    try:
+        return sync_user(
+            project_id, data.user_id, data.cursors, since=data.since, per_chat_limit=data.per_chat_limit,
+            continuation=data.continuation, max_chats=SYNC_MAX_CHATS,
+        )
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+
+# ---- Tiempo real ----
+@app.websocket("/ws/chats/{chat_id}")
+async def ws_chat(websocket: WebSocket, chat_id: str):
+    # Los navegadores no pueden enviar cabeceras en un WebSocket: se aceptan también como query params
+    project_id = websocket.headers.get("x-project-id") or websocket.query_params.get("project_id")
+    api_key = websocket.headers.get("x-api-key") or websocket.query_params.get("api_key")
+    if not project_id or not api_key:
+        await websocket.close(code=1008)
+        return
+    ok, chat = await asyncio.gather(
+        async_services.validate_project_auth(project_id, api_key),
+        async_services.get_chat(chat_id),
+    )
+    if not ok or not chat or chat["project_id"] != project_id:
+        await websocket.close(code=1008)
+        return
+
+    await websocket.accept()
+    sub = broker.subscribe(chat_id)
+
+    # Lee (y descarta) lo que mande el cliente para detectar la desconexión
+    async def watch_disconnect():
+        try:
+            while True:
+                await websocket.receive_text()
+        except WebSocketDisconnect:
+            pass
+        finally:
+            sub.close()
+
+    watcher = asyncio.create_task(watch_disconnect())
+    try:
+        while True:
+            event = await sub.get()
+            if event is None:
+                break
+            await asyncio.wait_for(websocket.send_text(dumps(event).decode()), REALTIME_SEND_TIMEOUT)
+    except (SlowConsumer, asyncio.TimeoutError):
+        # Cliente lento: se desconecta para no acumular eventos en memoria
+        sub.overflowed = True
+        try:
+            await websocket.close(code=1013)
+        except Exception:
+            pass
+    except WebSocketDisconnect:
+        pass
+    finally:
+        watcher.cancel()
+        broker.unsubscribe(sub)
+
+def sse_format(event: dict) -> str:
+    lines = []
+    if event.get("id"):
+        lines.append(f"id: {event['id']}")
+    lines.append(f"event: {event['type']}")
+    lines.append("data: " + dumps(event).decode())
+    return "\n".join(lines) + "\n\n"
+
+@app.get("/chats/{chat_id}/events")
+async def http_chat_events(
+    chat_id: str,
+    request: Request,
+    last_event_id: Optional[str] = Header(None, alias="Last-Event-ID"),
+    project_id: str = Depends(require_project_auth),
+):
+    chat = await async_services.get_chat(chat_id)
     if not chat or chat["project_id"] != project_id:
         raise HTTPException(404, "Chat no encontrado")
-    return add_message(chat_id, data.sender_id, data.text)
 
+    # Suscribirse antes de leer lo perdido para no dejar huecos; los repetidos se filtran por id
+    sub = broker.subscribe(chat_id)
+
+    async def stream():
+        sent = set()
+        try:
+            if last_event_id:
+                cursor, resent = last_event_id, 0
+                while resent < SSE_RESUME_MAX:
+                    try:
+                        page = await async_services.list_messages(
+                            chat_id, limit=min(MESSAGES_PAGE_MAX, SSE_RESUME_MAX - resent), after=cursor, chat=chat
+                        )
+                    except ValueError:
+                        yield sse_format({"type": "resync", "chat_id": chat_id})
+                        break
+                    for m in page["messages"]:
+                        event = message_event(chat_id, m)
+                        sent.add(event["id"])
+                        yield sse_format(event)
+                    resent += len(page["messages"])
+                    cursor = page["next_cursor"]
+                    if not page["has_more"]:
+                        break
+                else:
+                    # Demasiados mensajes perdidos: el cliente debe recargar con list_messages
+                    yield sse_format({"type": "resync", "chat_id": chat_id})
+
+            while True:
+                try:
+                    event = await asyncio.wait_for(sub.get(), SSE_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                if event is None:
+                    break
+                if event.get("id") in sent:
+                    sent.discard(event["id"])
+                    continue
+                yield sse_format(event)
+        except SlowConsumer:
+            pass
+        finally:
+            broker.unsubscribe(sub)
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
+
+
+# ---- Admin (frontend) ----
+# Las páginas son archivos estáticos (static/admin) con ETag; los datos se cargan por
+# partes desde /admin/api/* con búsqueda del lado del servidor.
+admin_assets = StaticAssets(os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "admin"), "/admin/assets")
 
 @app.get("/proyectos", response_class=HTMLResponse, tags=["frontend"])
-def proyectos_page():
-    proyectos = list_projects()
-    for p in proyectos:
-        if "created_at" in p and hasattr(p["created_at"], "isoformat"):
-            p["created_at"] = p["created_at"].isoformat()
-        if "updated_at" in p and hasattr(p["updated_at"], "isoformat"):
-            p["updated_at"] = p["updated_at"].isoformat()
-
-    proyectos_json = json.dumps(proyectos)
-
-    html = f"""
-    <!DOCTYPE html>
-    <html lang="es">
-    <head>
-      <meta charset="UTF-8">
-      <meta name="viewport" content="width=device-width, initial-scale=1.0">
-      <title>Gestión de Proyectos</title>
-      <style>
-        body {{
-          font-family: Arial, sans-serif;
-          margin: 0; padding: 2rem;
-          background: #f4f6f8;
-        }}
-        h1 {{ text-align: center; }}
-        #actions {{
-          text-align: center;
-          margin: 1rem 0;
-        }}
-        button {{
-          background: #1976d2;
-          border: none;
-          color: white;
-          padding: .6rem 1.2rem;
-          border-radius: 6px;
-          cursor: pointer;
-          margin: 0 .2rem;
-        }}
-        button.danger {{
-          background: #d32f2f;
-        }}
-        #search {{
-          display:block;
-          margin: 1rem auto;
-          padding: 0.6rem 1rem;
-          width: 80%;
-          max-width: 500px;
-          border:1px solid #ccc;
-          border-radius: 8px;
-        }}
-        .grid {{
-          display: grid;
-          grid-template-columns: repeat(auto-fill, minmax(280px, 1fr));
-          gap: 1rem;
-          margin-top: 2rem;
-        }}
-        .card {{
-          background: #fff;
-          padding: 1rem 1.2rem;
-          border-radius: 12px;
-          box-shadow: 0 2px 6px rgba(0,0,0,0.1);
-          transition: transform .2s;
-          position: relative;
-        }}
-        .card:hover {{ transform: translateY(-3px); }}
-        .card h2 {{
-          margin: 0 0 .5rem;
-          font-size: 1.2rem;
-          color: #333;
-        }}
-        .meta {{
-          font-size: .85rem;
-          color: #555;
-          margin-top: .3rem;
-        }}
-        .apikey {{
-          font-size: .75rem;
-          color: #777;
-          word-break: break-all;
-        }}
-        .card-actions {{
-          margin-top: .8rem;
-          text-align: right;
-        }}
-      </style>
-    </head>
-    <body>
-      <h1>Gestión de Proyectos</h1>
-      <div id="actions">
-        <button onclick="crearProyecto()">+ Nuevo Proyecto</button>
-      </div>
-      <input type="text" id="search" placeholder="Buscar proyecto por nombre o UUID...">
-
-      <div class="grid" id="cards"></div>
-
-      <script>
-        let proyectos = {proyectos_json};
-
-        const container = document.getElementById("cards");
-        const searchInput = document.getElementById("search");
-
-        function render(data){{
-          container.innerHTML = "";
-          if(!data.length){{
-            container.innerHTML = "<p>No hay proyectos.</p>";
-            return;
-          }}
-          data.forEach(p => {{
-            const card = document.createElement("div");
-            card.className = "card";
-            card.innerHTML = `
-              <h2>${{p.name}}</h2>
-              <div class="meta"><strong>UUID:</strong> ${{p.uuid}}</div>
-              <div class="apikey"><strong>API Key:</strong> ${{p.api_key}}</div>
-              <div class="meta"><strong>Creado:</strong> ${{p.created_at}}</div>
-              <div class="meta"><strong>Actualizado:</strong> ${{p.updated_at}}</div>
-              <div class="card-actions">
-                <button class="danger" onclick="eliminarProyecto('${{p.uuid}}')">Eliminar</button>
-              </div>
-            `;
-
-            
-            container.appendChild(card);
-          }});
-        }}
-
-        function filter(){{
-          const term = searchInput.value.toLowerCase();
-          const filtered = proyectos.filter(p =>
-            p.name.toLowerCase().includes(term) || p.uuid.toLowerCase().includes(term)
-          );
-          render(filtered);
-        }}
-        searchInput.addEventListener("input", filter);
-
-        async function crearProyecto(){{
-          const name = prompt("Nombre del nuevo proyecto:");
-          if(!name) return;
-          const res = await fetch("/projects", {{
-            method: "POST",
-            headers: {{ "Content-Type": "application/json" }},
-            body: JSON.stringify({{name}})
-          }});
-          if(res.ok){{
-            const nuevo = await res.json();
-            proyectos.unshift(nuevo);
-            render(proyectos);
-          }} else {{
-            alert("Error al crear proyecto");
-          }}
-        }}
-
-        async function eliminarProyecto(uuid){{
-          if(!confirm("¿Seguro que deseas eliminar este proyecto?")) return;
-          const res = await fetch(`/projects/${{uuid}}`, {{ method: "DELETE" }});
-          if(res.ok){{
-            proyectos = proyectos.filter(p => p.uuid !== uuid);
-            render(proyectos);
-          }} else {{
-            alert("Error al eliminar");
-          }}
-        }}
-
-        render(proyectos);
-      </script>
-    </body>
-    </html>
-    """
-    return HTMLResponse(content=html)
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
+def proyectos_page(request: Request):
+    return admin_assets.response("proyectos.html", request)
 
 @app.get("/chatsConfig", response_class=HTMLResponse, tags=["frontend"])
-def chats_config_page():
-    proyectos = list_projects()
-    chats = []
-
-    # Normalizar proyectos (convertir fechas a string)
-    for pr in proyectos:
-        if "created_at" in pr and isinstance(pr["created_at"], DatetimeWithNanoseconds):
-            pr["created_at"] = pr["created_at"].isoformat()
-        if "updated_at" in pr and isinstance(pr["updated_at"], DatetimeWithNanoseconds):
-            pr["updated_at"] = pr["updated_at"].isoformat()
-
-    # Recorrer proyectos válidos
-    for pr in proyectos:
-        pid = pr.get("uuid")
-        if not pid:
-            continue
-        for ch in list_chats(pid):
-            ch["project_name"] = pr.get("name", "sin-nombre")
-            ch["project_uuid"] = pid
-            chats.append(ch)
-
-    # Normalizar chats (convertir fechas a string)
-    for c in chats:
-        if "created_at" in c and isinstance(c["created_at"], DatetimeWithNanoseconds):
-            c["created_at"] = c["created_at"].isoformat()
-        if "updated_at" in c and isinstance(c["updated_at"], DatetimeWithNanoseconds):
-            c["updated_at"] = c["updated_at"].isoformat()
-
-    proyectos_json = json.dumps(proyectos)
-    chats_json = json.dumps(chats)
-
-
-    html = f"""
-    <!DOCTYPE html>
-    <html lang="es">
-    <head>
-      <meta charset="UTF-8">
-      <meta name="viewport" content="width=device-width, initial-scale=1.0">
-      <title>Gestión de Chats</title>
-      <style>
-        body {{
-          font-family: Arial, sans-serif;
-          margin: 0; padding: 2rem;
-          background: #f4f6f8;
-        }}
-        h1 {{ text-align: center; }}
-        #actions {{
-          text-align: center;
-          margin: 1rem 0;
-        }}
-        button {{
-          background: #1976d2;
-          border: none;
-          color: white;
-          padding: .6rem 1.2rem;
-          border-radius: 6px;
-          cursor: pointer;
-          margin: 0 .2rem;
-        }}
-        button.danger {{
-          background: #d32f2f;
-        }}
-        #search {{
-          display:block;
-          margin: 1rem auto;
-          padding: 0.6rem 1rem;
-          width: 80%;
-          max-width: 500px;
-          border:1px solid #ccc;
-          border-radius: 8px;
-        }}
-        .grid {{
-          display: grid;
-          grid-template-columns: repeat(auto-fill, minmax(320px, 1fr));
-          gap: 1rem;
-          margin-top: 2rem;
-        }}
-        .card {{
-          background: #fff;
-          padding: 1rem 1.2rem;
-          border-radius: 12px;
-          box-shadow: 0 2px 6px rgba(0,0,0,0.1);
-        }}
-        .card h2 {{
-          margin: 0 0 .5rem;
-          font-size: 1.2rem;
-          color: #333;
-        }}
-        .meta {{
-          font-size: .85rem;
-          color: #555;
-          margin-top: .3rem;
-        }}
-        .card-actions {{
-          margin-top: .8rem;
-          text-align: right;
-        }}
-      </style>
-    </head>
-    <body>
-      <h1>Gestión de Chats</h1>
-      <div id="actions">
-        <button onclick="crearChat()">+ Nuevo Chat</button>
-      </div>
-      <input type="text" id="search" placeholder="Buscar chat por proyecto o usuarios...">
-
-      <div class="grid" id="cards"></div>
-
-      <script>
-        let proyectos = {proyectos_json};
-        let chats = {chats_json};
-
-        const container = document.getElementById("cards");
-        const searchInput = document.getElementById("search");
-
-        function render(data){{
-          container.innerHTML = "";
-          if(!data.length){{
-            container.innerHTML = "<p>No hay chats.</p>";
-            return;
-          }}
-          data.forEach(c => {{
-            const card = document.createElement("div");
-            card.className = "card";
-            card.innerHTML = `
-              <h2>${{c.type.toUpperCase()}} Chat</h2>
-              <div class="meta"><strong>Proyecto:</strong> ${{c.project_name}} (${{c.project_uuid}})</div>
-              <div class="meta"><strong>Chat ID:</strong> ${{c.id}}</div>
-              <div class="meta"><strong>Usuarios:</strong> ${{(c.users || []).join(", ")}}</div>
-              <div class="meta"><strong>Creado:</strong> ${{c.created_at || ""}}</div>
-              <div class="card-actions">
-                <button class="danger" onclick="eliminarChat('${{c.id}}','${{c.project_uuid}}')">Eliminar</button>
-              </div>
-            `;
-
-
-
-            container.appendChild(card);
-          }});
-        }}
-
-        function filter(){{
-          const term = searchInput.value.toLowerCase();
-          const filtered = chats.filter(c =>
-            c.project_name.toLowerCase().includes(term) ||
-            (c.users || []).some(u => u.toLowerCase().includes(term))
-          );
-          render(filtered);
-        }}
-        searchInput.addEventListener("input", filter);
-
-        async function crearChat(){{
-          const pid = prompt("UUID del proyecto:");
-          if(!pid) return;
-          const type = prompt("Tipo de chat (direct/group):");
-          if(!type) return;
-          const users = prompt("Usuarios (separados por coma):");
-          if(!users) return;
-          let url = type === "direct" ? "/chats/direct" : "/chats/group";
-          const res = await fetch(url, {{
-            method: "POST",
-            headers: {{
-              "Content-Type": "application/json",
-              "X-Project-Id": pid,
-              "X-Api-Key": proyectos.find(p => p.uuid===pid)?.api_key || ""
-            }},
-            body: JSON.stringify({{users: users.split(",").map(u=>u.trim()), title:"Nuevo Chat"}})
-          }});
-          if(res.ok){{
-            const nuevo = await res.json();
-            nuevo.project_uuid = pid;
-            nuevo.project_name = proyectos.find(p=>p.uuid===pid)?.name || "";
-            chats.unshift(nuevo);
-            render(chats);
-          }} else {{
-            alert("Error al crear chat");
-          }}
-        }}
-
-        async function eliminarChat(id, pid){{
-          if(!confirm("¿Seguro que deseas eliminar este chat?")) return;
-          const res = await fetch(`/chats/${{id}}`, {{
-            method: "DELETE",
-            headers: {{
-              "X-Project-Id": pid,
-              "X-Api-Key": proyectos.find(p => p.uuid===pid)?.api_key || ""
-            }}
-          }});
-          if(res.ok){{
-            chats = chats.filter(c => c.id !== id);
-            render(chats);
-          }} else {{
-            alert("Error al eliminar");
-          }}
-        }}
-
-        render(chats);
-      </script>
-    </body>
-    </html>
-    """
-    return HTMLResponse(content=html)
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
+def chats_config_page(request: Request):
+    return admin_assets.response("chatsConfig.html", request)
 
 @app.get("/mensajes", response_class=HTMLResponse, tags=["frontend"])
-def mensajes_page():
-    # Reunir proyectos y chats
-    proyectos = list_projects()
-    chats = []
-    for pr in proyectos:
-        # Normalizar fechas de proyectos
-        if "created_at" in pr and isinstance(pr["created_at"], DatetimeWithNanoseconds):
-            pr["created_at"] = pr["created_at"].isoformat()
-        if "updated_at" in pr and isinstance(pr["updated_at"], DatetimeWithNanoseconds):
-            pr["updated_at"] = pr["updated_at"].isoformat()
-
-    for pr in proyectos:
-        pid = pr.get("uuid")
-        if not pid:
-            continue
-        for ch in list_chats(pid):
-            ch["project_name"] = pr.get("name", "sin-nombre")
-            ch["project_uuid"] = pid
-            # Normalizar fechas de chats
-            if "created_at" in ch and isinstance(ch["created_at"], DatetimeWithNanoseconds):
-                ch["created_at"] = ch["created_at"].isoformat()
-            chats.append(ch)
-
-    import json
-    proyectos_json = json.dumps(proyectos)
-    chats_json = json.dumps(chats)
-
-    # IMPORTANTE: no usar f-string para que las llaves {} de CSS/JS no rompan el render
-    html = """
-<!DOCTYPE html>
-<html lang="es">
-<head>
-  <meta charset="UTF-8">
-  <meta name="viewport" content="width=device-width, initial-scale=1.0">
-  <title>Mensajes de Chats</title>
-  <style>
-    body {
-      font-family: Arial, sans-serif;
-      margin: 0; padding: 2rem;
-      background: #f4f6f8;
-    }
-    h1 { text-align: center; }
-    .grid {
-      display: grid;
-      grid-template-columns: repeat(auto-fill, minmax(280px, 1fr));
-      gap: 1rem;
-      margin-top: 2rem;
-    }
-    .card {
-      background: #fff;
-      padding: 1rem;
-      border-radius: 10px;
-      box-shadow: 0 2px 6px rgba(0,0,0,0.1);
-      cursor: pointer;
-    }
-    .card:hover { background: #f0f8ff; }
-    #messages-section {
-      margin-top: 2rem;
-      padding: 1rem;
-      background: #fff;
-      border-radius: 10px;
-      box-shadow: 0 2px 6px rgba(0,0,0,0.1);
-    }
-    .message {
-      border-bottom: 1px solid #eee;
-      padding: .5rem 0;
-    }
-    .message strong { color: #1976d2; }
-    form {
-      margin-top: 1rem;
-      display: flex;
-      gap: .5rem;
-      flex-wrap: wrap;
-    }
-    select, input {
-      padding: .5rem;
-      border: 1px solid #ccc;
-      border-radius: 5px;
-    }
-    button {
-      padding: .5rem 1rem;
-      border: none;
-      border-radius: 5px;
-      background: #1976d2;
-      color: white;
-      cursor: pointer;
-    }
-  </style>
-</head>
-<body>
-  <h1>Gestión de Mensajes</h1>
-  <h2>Chats disponibles</h2>
-  <div class="grid" id="chats"></div>
-
-  <section id="messages-section" style="display:none;">
-    <h2 id="chat-title">Mensajes del chat</h2>
-    <div id="messages"></div>
-
-    <form id="new-message-form">
-      <select id="sender"></select>
-      <select id="receiver"></select>
-      <input type="text" id="text" placeholder="Escribe tu mensaje..." required>
-      <button type="submit">Enviar</button>
-    </form>
-  </section>
-
-  <script>
-    let proyectos = """ + proyectos_json + """;
-    let chats = """ + chats_json + """;
-
-    const chatsContainer = document.getElementById("chats");
-    const messagesSection = document.getElementById("messages-section");
-    const messagesDiv = document.getElementById("messages");
-    const chatTitle = document.getElementById("chat-title");
-    const form = document.getElementById("new-message-form");
-    const senderSel = document.getElementById("sender");
-    const receiverSel = document.getElementById("receiver");
-    const textInput = document.getElementById("text");
-
-    let currentChat = null;
-    let currentProject = null;
-
-    function renderChats() {
-      chatsContainer.innerHTML = "";
-      chats.forEach(c => {
-        const card = document.createElement("div");
-        card.className = "card";
-        card.innerHTML = `
-          <h3>${c.type.toUpperCase()} Chat</h3>
-          <div><strong>ID:</strong> ${c.id}</div>
-          <div><strong>Proyecto:</strong> ${c.project_name} (${c.project_uuid})</div>
-          <div><strong>Usuarios:</strong> ${(c.users || []).join(", ")}</div>
-        `;
-        card.onclick = () => openChat(c);
-        chatsContainer.appendChild(card);
-      });
-    }
-
-    async function openChat(chat) {
-      currentChat = chat;
-      currentProject = (proyectos || []).find(p => p.uuid === chat.project_uuid) || null;
-      chatTitle.textContent = `Mensajes del chat (${chat.id})`;
-      messagesSection.style.display = "block";
-
-      // llenar selects con usuarios
-      senderSel.innerHTML = "";
-      receiverSel.innerHTML = "";
-      (chat.users || []).forEach(u => {
-        senderSel.innerHTML += `<option value="${u}">${u}</option>`;
-        receiverSel.innerHTML += `<option value="${u}">${u}</option>`;
-      });
-
-      await loadMessages(chat.id);
-    }
-
-    async function loadMessages(chatId) {
-      const headers = {};
-      if (currentProject) {
-        headers["X-Project-Id"] = currentChat.project_uuid;
-        headers["X-Api-Key"] = currentProject.api_key || "";
-      }
-      const res = await fetch(`/chats/${chatId}/messages`, { headers });
-      if (res.ok) {
-        const msgs = await res.json();
-        renderMessages(msgs);
-      } else {
-        messagesDiv.innerHTML = "<p>Error al cargar mensajes</p>";
-      }
-    }
-
-    function renderMessages(msgs) {
-      messagesDiv.innerHTML = "";
-      if (!msgs.length) {
-        messagesDiv.innerHTML = "<p>No hay mensajes aún</p>";
-        return;
-      }
-      msgs.forEach(m => {
-        const div = document.createElement("div");
-        div.className = "message";
-        div.innerHTML = `<strong>${m.sender_id}</strong> → <em>${m.text}</em> <span style="font-size:.8rem;color:#555">[${m.timestamp}]</span>`;
-        messagesDiv.appendChild(div);
-      });
-    }
-
-    form.onsubmit = async (e) => {
-      e.preventDefault();
-      const sender = senderSel.value;
-      const text = textInput.value;
-      if (!sender || !text) return;
-
-      const headers = {
-        "Content-Type": "application/json"
-      };
-      if (currentProject) {
-        headers["X-Project-Id"] = currentChat.project_uuid;
-        headers["X-Api-Key"] = currentProject.api_key || "";
-      }
-
-      const res = await fetch(`/chats/${currentChat.id}/messages`, {
-        method: "POST",
-        headers,
-        body: JSON.stringify({ sender_id: sender, text })
-      });
-      if (res.ok) {
-        textInput.value = "";
-        await loadMessages(currentChat.id);
-      } else {
-        alert("Error al enviar mensaje");
-      }
-    };
-
-    renderChats();
-  </script>
-</body>
-</html>
-"""
-    return HTMLResponse(content=html)
-
-
-
-
-
-
+def mensajes_page(request: Request):
+    return admin_assets.response("mensajes.html", request)
+
+@app.get("/admin/assets/{name}", tags=["frontend"])
+def admin_asset(name: str, request: Request, v: Optional[str] = None):
+    return admin_assets.response(name, request, version=v)
+
+@app.get("/admin/api/projects", tags=["frontend"])
+def admin_api_projects(
+    q: Optional[str] = None,
+    limit: int = Query(ADMIN_PAGE_DEFAULT, ge=1, le=ADMIN_PAGE_MAX),
+    cursor: Optional[str] = None,
+):
+    try:
+        return admin_list_projects(q, limit, cursor)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+
+@app.get("/admin/api/chats", tags=["frontend"])
+def admin_api_chats(
+    project_id: Optional[str] = None,
+    q: Optional[str] = None,
+    limit: int = Query(ADMIN_PAGE_DEFAULT, ge=1, le=ADMIN_PAGE_MAX),
+    cursor: Optional[str] = None,
+):
+    try:
+        return admin_list_chats(project_id, q, limit, cursor)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
 
 
 from services import save_fcm_token_to_db
 
+# def (no async): la escritura en Firestore es bloqueante y corre en el threadpool
 @app.post("/save-fcm-token")
-async def save_fcm_token(fcm_token: FCMToken):
+def save_fcm_token(fcm_token: FCMToken):
     # Aquí ya no necesitas acceder a 'db' directamente
     print(f"Token FCM recibido para el usuario {fcm_token.user_id}: {fcm_token.fcm_token}")
 
@@ -0,0 +1,491 @@
+"""
+Backend en memoria compatible con el subconjunto del cliente de Firestore que usa la API
+(colecciones, documentos, consultas con where/order_by/start_after/limit, count(), get_all,
+WriteBatch, transacciones e Increment), en versión sync y async.
+
+Se selecciona con STORAGE_BACKEND=memory (ver firebase_config.py) para correr la API
+localmente, sin proyecto de Firebase, en benchmarks y pruebas. Respeta el orden implícito
+por id de documento, la exclusión de documentos sin el campo ordenado y el límite de
+500 operaciones por batch.
+"""
+from __future__ import annotations
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from datetime import datetime, timezone
+import copy
+import functools
+import secrets
+import string
+import threading
+
+from google.api_core.datetime_helpers import DatetimeWithNanoseconds
+from google.api_core.exceptions import AlreadyExists, InvalidArgument, NotFound
+from google.cloud.firestore_v1.field_path import FieldPath, split_field_path
+from google.cloud.firestore_v1.transforms import Increment
+
+# Límite de operaciones por batch/transacción de Firestore
+MAX_WRITES = 500
+
+_ID_ALPHABET = string.ascii_letters + string.digits
+_NAME = "__name__"
+
+
+def _auto_id():
+    return "".join(secrets.choice(_ID_ALPHABET) for _ in range(20))
+
+
+def _to_stored(value):
+    """Copia el valor como lo devolvería Firestore (datetimes en UTC con nanosegundos)."""
+    if isinstance(value, datetime):
+        v = value.astimezone(timezone.utc) if value.tzinfo else value.replace(tzinfo=timezone.utc)
+        return DatetimeWithNanoseconds(v.year, v.month, v.day, v.hour, v.minute, v.second, v.microsecond,
+                                       tzinfo=timezone.utc)
+    if isinstance(value, dict):
+        return {k: _to_stored(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_to_stored(v) for v in value]
+    return value
+
+
+@functools.lru_cache(maxsize=4096)
+def _split(field: str) -> Tuple[str, ...]:
+    return (field,) if field == _NAME else tuple(split_field_path(field))
+
+
+def _get_field(data: Dict[str, Any], parts: Tuple[str, ...]):
+    cur: Any = data
+    for p in parts:
+        if not isinstance(cur, dict) or p not in cur:
+            return False, None
+        cur = cur[p]
+    return True, cur
+
+
+def _apply(data: Dict[str, Any], updates: Dict[str, Any], dotted: bool, merge: bool = False):
+    for key, value in updates.items():
+        parts = _split(key) if dotted else (key,)
+        cur = data
+        for p in parts[:-1]:
+            nxt = cur.get(p)
+            if not isinstance(nxt, dict):
+                nxt = cur[p] = {}
+            cur = nxt
+        if isinstance(value, Increment):
+            prev = cur.get(parts[-1])
+            cur[parts[-1]] = (prev if isinstance(prev, (int, float)) else 0) + value.value
+        elif isinstance(value, dict) and not dotted:
+            if not (merge and isinstance(cur.get(parts[-1]), dict)):
+                cur[parts[-1]] = {}
+            _apply(cur[parts[-1]], value, False, merge)
+        else:
+            cur[parts[-1]] = _to_stored(value)
+
+
+def _cmp(a, b) -> int:
+    if a == b:
+        return 0
+    if a is None:
+        return -1
+    if b is None:
+        return 1
+    return -1 if a < b else 1
+
+
+class _Store:
+    def __init__(self):
+        self.lock = threading.RLock()
+        # ruta de colección -> {doc_id: datos}
+        self.collections: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        # Operaciones facturables, contadas como en Firestore (benchmarks)
+        self.ops = {"reads": 0, "writes": 0, "queries": 0}
+
+    def read(self, coll: str, doc_id: str):
+        self.ops["reads"] += 1
+        data = self.collections.get(coll, {}).get(doc_id)
+        return copy.deepcopy(data) if data is not None else None
+
+
+class DocumentSnapshot:
+    def __init__(self, reference: "DocumentReference", data: Optional[Dict[str, Any]]):
+        self.reference = reference
+        self.id = reference.id
+        self.exists = data is not None
+        self._data = data
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field: str):
+        return _get_field(self._data or {}, _split(field))[1]
+
+
+class DocumentReference:
+    def __init__(self, client: "MemoryClient", coll_path: str, doc_id: str):
+        self._client = client
+        self._coll_path = coll_path
+        self.id = doc_id
+
+    @property
+    def path(self):
+        return f"{self._coll_path}/{self.id}"
+
+    def collection(self, name: str):
+        return self._client._coll_cls(self._client, f"{self.path}/{name}")
+
+    def get(self, transaction=None):
+        with self._client._store.lock:
+            return DocumentSnapshot(self, self._client._store.read(self._coll_path, self.id))
+
+    def set(self, data: Dict[str, Any], merge: bool = False):
+        batch = self._client._batch_cls(self._client)
+        batch.set(self, data, merge=merge)
+        return WriteBatch.commit(batch)
+
+    def create(self, data: Dict[str, Any]):
+        batch = self._client._batch_cls(self._client)
+        batch.create(self, data)
+        return WriteBatch.commit(batch)
+
+    def update(self, data: Dict[str, Any]):
+        batch = self._client._batch_cls(self._client)
+        batch.update(self, data)
+        return WriteBatch.commit(batch)
+
+    def delete(self):
+        batch = self._client._batch_cls(self._client)
+        batch.delete(self)
+        return WriteBatch.commit(batch)
+
+
+class AggregationResult:
+    def __init__(self, alias: str, value: int):
+        self.alias = alias
+        self.value = value
+
+
+class CountQuery:
+    def __init__(self, query: "Query", alias: str = "count"):
+        self._query = query
+        self._alias = alias
+
+    def get(self, transaction=None):
+        n = len(self._query._run(count_only=True))
+        # count() se factura como una lectura cada 1000 entradas de índice
+        with self._query._client._store.lock:
+            self._query._client._store.ops["reads"] += max(1, -(-n // 1000))
+        return [[AggregationResult(self._alias, n)]]
+
+
+class Query:
+    def __init__(self, client: "MemoryClient", coll_path: str, filters: Tuple = (), orders: Tuple = (),
+                 start: Optional[Tuple[Dict[str, Any], bool]] = None, limit: Optional[int] = None):
+        self._client = client
+        self._coll_path = coll_path
+        self._filters = filters
+        self._orders = orders
+        self._start = start
+        self._limit = limit
+
+    def _copy(self, **kw):
+        args = dict(filters=self._filters, orders=self._orders, start=self._start, limit=self._limit)
+        args.update(kw)
+        return self._client._query_cls(self._client, self._coll_path, **args)
+
+    def where(self, field_path: str = None, op_string: str = None, value: Any = None, filter=None):
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        return self._copy(filters=self._filters + ((field_path, op_string, value),))
+
+    def order_by(self, field_path: str, direction: str = "ASCENDING"):
+        return self._copy(orders=self._orders + ((field_path, direction),))
+
+    def start_after(self, document_fields):
+        return self._copy(start=(self._cursor_values(document_fields), False))
+
+    def start_at(self, document_fields):
+        return self._copy(start=(self._cursor_values(document_fields), True))
+
+    def limit(self, count: int):
+        return self._copy(limit=count)
+
+    def count(self, alias: str = "count"):
+        return CountQuery(self, alias)
+
+    def _cursor_values(self, document_fields):
+        if isinstance(document_fields, DocumentSnapshot):
+            snap = document_fields
+            document_fields = {f: (snap.id if f == _NAME else snap.get(f)) for f, _ in self._effective_orders()}
+        return dict(document_fields)
+
+    def _effective_orders(self):
+        orders = list(self._orders)
+        if not any(f == _NAME for f, _ in orders):
+            # Firestore ordena implícitamente por id de documento en la dirección del último orden
+            orders.append((_NAME, orders[-1][1] if orders else "ASCENDING"))
+        return orders
+
+    @staticmethod
+    def _value(doc_id: str, data: Dict[str, Any], field: str):
+        if field == _NAME:
+            return True, doc_id
+        return _get_field(data, _split(field))
+
+    def _matches(self, doc_id: str, data: Dict[str, Any]) -> bool:
+        for field, op, value in self._filters:
+            found, v = self._value(doc_id, data, field)
+            if not found:
+                return False
+            if isinstance(value, DocumentReference):
+                value = value.id
+            if op == "==":
+                ok = v == value
+            elif op == "!=":
+                ok = v is not None and v != value
+            elif op == "<":
+                ok = v is not None and v < value
+            elif op == "<=":
+                ok = v is not None and v <= value
+            elif op == ">":
+                ok = v is not None and v > value
+            elif op == ">=":
+                ok = v is not None and v >= value
+            elif op == "array_contains":
+                ok = isinstance(v, list) and value in v
+            elif op == "array_contains_any":
+                ok = isinstance(v, list) and any(x in v for x in value)
+            elif op == "in":
+                ok = v in value
+            elif op == "not-in":
+                ok = v is not None and v not in value
+            else:
+                raise InvalidArgument(f"Operador no soportado: {op}")
+            if not ok:
+                return False
+        return True
+
+    def _run(self, count_only: bool = False):
+        store = self._client._store
+        with store.lock:
+            items = [(doc_id, data) for doc_id, data in store.collections.get(self._coll_path, {}).items()
+                     if self._matches(doc_id, data)]
+            return self._select(items, count_only)
+
+    def _select(self, items, count_only: bool):
+        orders = self._effective_orders()
+
+        # Los documentos sin alguno de los campos ordenados quedan fuera (igual que en Firestore)
+        rows = []
+        for doc_id, data in items:
+            keys = []
+            for field, _ in orders:
+                found, v = self._value(doc_id, data, field)
+                if not found:
+                    break
+                keys.append(v)
+            else:
+                rows.append((keys, doc_id, data))
+
+        def compare(ka, kb):
+            for (_, direction), a, b in zip(orders, ka, kb):
+                c = _cmp(a, b)
+                if c:
+                    return -c if direction == "DESCENDING" else c
+            return 0
+
+        # Ordenamientos estables sucesivos, del último criterio al primero
+        for i in range(len(orders) - 1, -1, -1):
+            rows.sort(key=lambda r: (r[0][i] is not None, r[0][i]), reverse=orders[i][1] == "DESCENDING")
+
+        if self._start:
+            values, inclusive = self._start
+            cursor = []
+            for field, _ in orders:
+                if field not in values:
+                    break
+                v = values[field]
+                cursor.append(v.id if isinstance(v, DocumentReference) else v)
+            n = len(cursor)
+            rows = [r for r in rows if (compare(r[0][:n], cursor) >= 0 if inclusive else compare(r[0][:n], cursor) > 0)]
+
+        if self._limit is not None:
+            rows = rows[:self._limit]
+        if count_only:
+            return rows
+        ops = self._client._store.ops
+        ops["queries"] += 1
+        ops["reads"] += max(1, len(rows))
+        return [DocumentSnapshot(self._client._doc_cls(self._client, self._coll_path, doc_id), copy.deepcopy(data))
+                for _, doc_id, data in rows]
+
+    def stream(self, transaction=None):
+        return iter(self._run())
+
+    def get(self, transaction=None):
+        return self._run()
+
+
+class CollectionReference(Query):
+    def __init__(self, client: "MemoryClient", coll_path: str, **kw):
+        super().__init__(client, coll_path, **kw)
+        self.id = coll_path.rsplit("/", 1)[-1]
+
+    def document(self, document_id: Optional[str] = None):
+        return self._client._doc_cls(self._client, self._coll_path, document_id or _auto_id())
+
+    def add(self, document_data: Dict[str, Any], document_id: Optional[str] = None):
+        ref = self.document(document_id)
+        ref.create(document_data)
+        return datetime.now(timezone.utc), ref
+
+
+class WriteBatch:
+    def __init__(self, client: "MemoryClient"):
+        self._client = client
+        self._ops: List[Tuple[str, DocumentReference, Any]] = []
+
+    def set(self, reference, document_data, merge: bool = False):
+        self._ops.append(("merge" if merge else "set", reference, document_data))
+
+    def create(self, reference, document_data):
+        self._ops.append(("create", reference, document_data))
+
+    def update(self, reference, field_updates):
+        self._ops.append(("update", reference, field_updates))
+
+    def delete(self, reference):
+        self._ops.append(("delete", reference, None))
+
+    def commit(self):
+        if len(self._ops) > MAX_WRITES:
+            raise InvalidArgument(f"Un batch admite como máximo {MAX_WRITES} escrituras")
+        store = self._client._store
+        with store.lock:
+            store.ops["writes"] += len(self._ops)
+            # Validar todo antes de aplicar: el batch es atómico
+            exists = {}
+            for kind, ref, _ in self._ops:
+                key = (ref._coll_path, ref.id)
+                if key not in exists:
+                    exists[key] = ref.id in store.collections.get(ref._coll_path, {})
+                if kind == "create" and exists[key]:
+                    raise AlreadyExists(f"Document already exists: {ref.path}")
+                if kind == "update" and not exists[key]:
+                    raise NotFound(f"No document to update: {ref.path}")
+                exists[key] = kind != "delete"
+            for kind, ref, data in self._ops:
+                coll = store.collections.setdefault(ref._coll_path, {})
+                if kind == "delete":
+                    coll.pop(ref.id, None)
+                    continue
+                doc = {} if kind in ("set", "create") else coll.get(ref.id, {})
+                _apply(doc, data, dotted=(kind == "update"), merge=(kind == "merge"))
+                coll[ref.id] = doc
+        self._ops = []
+        return []
+
+
+class Transaction(WriteBatch):
+    """Las transacciones se ejecutan con el lock del store tomado (serializables)."""
+
+
+def transactional(fn: Callable):
+    """Equivalente a google.cloud.firestore_v1.transactional para el backend en memoria."""
+    @functools.wraps(fn)
+    def wrapper(transaction: Transaction, *args, **kwargs):
+        with transaction._client._store.lock:
+            result = fn(transaction, *args, **kwargs)
+            transaction.commit()
+            return result
+    return wrapper
+
+
+class MemoryClient:
+    _doc_cls = DocumentReference
+    _coll_cls = CollectionReference
+    _query_cls = Query
+    _batch_cls = WriteBatch
+
+    def __init__(self, store: Optional[_Store] = None):
+        self._store = store or _Store()
+
+    def collection(self, name: str):
+        return self._coll_cls(self, name)
+
+    def batch(self):
+        return self._batch_cls(self)
+
+    def transaction(self, **kw):
+        return Transaction(self)
+
+    def get_all(self, references: Iterable[DocumentReference], field_paths=None, transaction=None):
+        with self._store.lock:
+            return [DocumentSnapshot(r, self._store.read(r._coll_path, r.id)) for r in references]
+
+    @staticmethod
+    def field_path(*field_names: str):
+        return FieldPath(*field_names).to_api_repr()
+
+    def reset(self):
+        with self._store.lock:
+            self._store.collections.clear()
+
+    def op_counts(self) -> Dict[str, int]:
+        with self._store.lock:
+            return dict(self._store.ops)
+
+
+# ---- Versión async (misma semántica, métodos awaitables) ----
+class AsyncDocumentReference(DocumentReference):
+    async def get(self, transaction=None):
+        return DocumentReference.get(self)
+
+    async def set(self, data, merge: bool = False):
+        return DocumentReference.set(self, data, merge=merge)
+
+    async def create(self, data):
+        return DocumentReference.create(self, data)
+
+    async def update(self, data):
+        return DocumentReference.update(self, data)
+
+    async def delete(self):
+        return DocumentReference.delete(self)
+
+
+class AsyncCountQuery(CountQuery):
+    async def get(self, transaction=None):
+        return CountQuery.get(self)
+
+
+class AsyncQuery(Query):
+    def count(self, alias: str = "count"):
+        return AsyncCountQuery(self, alias)
+
+    async def stream(self, transaction=None):
+        for snap in self._run():
+            yield snap
+
+    async def get(self, transaction=None):
+        return self._run()
+
+
+class AsyncCollectionReference(AsyncQuery, CollectionReference):
+    async def add(self, document_data, document_id: Optional[str] = None):
+        ref = self.document(document_id)
+        await ref.create(document_data)
+        return datetime.now(timezone.utc), ref
+
+
+class AsyncWriteBatch(WriteBatch):
+    async def commit(self):
+        return WriteBatch.commit(self)
+
+
+class AsyncMemoryClient(MemoryClient):
+    _doc_cls = AsyncDocumentReference
+    _coll_cls = AsyncCollectionReference
+    _query_cls = AsyncQuery
+    _batch_cls = AsyncWriteBatch
+
+    async def get_all(self, references, field_paths=None, transaction=None):
+        for snap in MemoryClient.get_all(self, references):
+            yield snap
@@ -0,0 +1,163 @@
+"""
+Métricas Prometheus de la API (GET /metrics).
+
+- Latencia por ruta y peticiones en curso (PrometheusMiddleware).
+- Latencia de Firestore por operación y colección (listener de instrumentation.py).
+- Latencia y resultado de los envíos FCM (observe_fcm_send, desde send_push_notification).
+- Tamaño, llenado y motivo de cierre de los commits agrupados (observe_group_commit).
+- Hits/misses de los caches (register_cache). La tasa de aciertos se calcula en la consulta:
+  cache_hits / (cache_hits + cache_misses), lo que también vale al sumar varios workers.
+
+Con varios workers (uvicorn/gunicorn --workers N) definir PROMETHEUS_MULTIPROC_DIR con un
+directorio vacío y compartido: cada proceso escribe sus valores ahí y /metrics los agrega.
+"""
+from __future__ import annotations
+from typing import Any, Callable, Dict, Tuple
+import os
+import time
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, generate_latest,
+)
+from prometheus_client import multiprocess
+from instrumentation import add_listener
+
+MULTIPROCESS = bool(os.getenv("PROMETHEUS_MULTIPROC_DIR"))
+
+HTTP_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+FIRESTORE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+
+http_requests = Counter("http_requests_total", "Peticiones HTTP", ["method", "route", "status"])
+http_latency = Histogram("http_request_duration_seconds", "Latencia de las peticiones HTTP",
+                         ["method", "route"], buckets=HTTP_BUCKETS)
+http_in_flight = Gauge("http_requests_in_flight", "Peticiones HTTP en curso", ["method"],
+                       multiprocess_mode="livesum")
+
+firestore_latency = Histogram("firestore_operation_duration_seconds", "Latencia de las operaciones de Firestore",
+                              ["operation", "collection"], buckets=FIRESTORE_BUCKETS)
+firestore_reads = Counter("firestore_document_reads_total", "Documentos leídos de Firestore", ["collection"])
+firestore_writes = Counter("firestore_document_writes_total", "Documentos escritos en Firestore", ["collection"])
+
+fcm_latency = Histogram("fcm_send_duration_seconds", "Latencia de send_each_for_multicast", buckets=HTTP_BUCKETS)
+fcm_messages = Counter("fcm_messages_total", "Notificaciones FCM por resultado", ["result"])
+
+group_commit_size = Histogram("group_commit_batch_size", "Mensajes por commit agrupado",
+                              buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500))
+group_commit_fill = Histogram("group_commit_batch_fill_ratio", "Llenado de cada commit agrupado (mensajes / máximo)",
+                              buckets=(0.01, 0.02, 0.05, 0.1, 0.25, 0.5, 0.75, 1))
+group_commit_latency = Histogram("group_commit_duration_seconds", "Latencia del commit de cada lote agrupado",
+                                 buckets=FIRESTORE_BUCKETS)
+group_commit_flushes = Counter("group_commit_flushes_total", "Commits agrupados por motivo de cierre (full/delay)",
+                               ["reason"])
+
+cache_hits = Gauge("cache_hits", "Hits acumulados del cache", ["cache"], multiprocess_mode="livesum")
+cache_misses = Gauge("cache_misses", "Misses acumulados del cache", ["cache"], multiprocess_mode="livesum")
+cache_size = Gauge("cache_entries", "Entradas en el cache", ["cache"], multiprocess_mode="livesum")
+
+_caches: Dict[str, Callable[[], Dict[str, Any]]] = {}
+_caches_updated = 0.0
+# Cada proceso publica los valores de sus caches como mucho una vez por segundo
+CACHE_REFRESH_SECONDS = 1.0
+# Los hijos con labels se resuelven una vez: .labels() en cada observación es lo más caro del camino caliente
+_children: Dict[Tuple, Any] = {}
+
+
+def _child(metric, *labels):
+    key = (id(metric),) + labels
+    child = _children.get(key)
+    if child is None:
+        child = _children[key] = metric.labels(*labels)
+    return child
+
+
+def observe_firestore(op: str, collection: str, seconds: float, reads: int, writes: int):
+    _child(firestore_latency, op, collection).observe(seconds)
+    if reads:
+        _child(firestore_reads, collection).inc(reads)
+    if writes:
+        _child(firestore_writes, collection).inc(writes)
+
+
+add_listener(observe_firestore)
+
+
+def observe_fcm_send(seconds: float, success: int, failure: int):
+    fcm_latency.observe(seconds)
+    if success:
+        _child(fcm_messages, "success").inc(success)
+    if failure:
+        _child(fcm_messages, "failure").inc(failure)
+
+
+def observe_group_commit(size: int, max_batch: int, reason: str, seconds: float):
+    group_commit_size.observe(size)
+    group_commit_fill.observe(size / max_batch)
+    group_commit_latency.observe(seconds)
+    _child(group_commit_flushes, reason).inc()
+
+
+def register_cache(name: str, stats: Callable[[], Dict[str, Any]]):
+    """`stats()` debe devolver hits, misses y size (como TTLCache.stats())."""
+    _caches[name] = stats
+
+
+def _update_caches():
+    global _caches_updated
+    _caches_updated = time.monotonic()
+    for name, stats in _caches.items():
+        s = stats()
+        cache_hits.labels(name).set(s["hits"])
+        cache_misses.labels(name).set(s["misses"])
+        cache_size.labels(name).set(s["size"])
+
+
+def render() -> Tuple[bytes, str]:
+    """Cuerpo y content-type de /metrics."""
+    _update_caches()
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead(pid: int):
+    """Para el hook child_exit de gunicorn en modo multiproceso."""
+    if MULTIPROCESS:
+        multiprocess.mark_process_dead(pid)
+
+
+class PrometheusMiddleware:
+    """Middleware ASGI: latencia, estado y peticiones en curso por ruta (plantilla, no URL)."""
+
+    def __init__(self, app, skip_paths=("/metrics",)):
+        self.app = app
+        self.skip_paths = set(skip_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.skip_paths:
+            return await self.app(scope, receive, send)
+
+        method = scope["method"]
+        status = 500
+        # La ruta recién se conoce después del ruteo: las peticiones en curso se agrupan por método
+        in_flight = _child(http_in_flight, method)
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        in_flight.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            in_flight.dec()
+            route = scope.get("route")
+            route = getattr(route, "path", None) or "unmatched"
+            _child(http_latency, method, route).observe(time.perf_counter() - started)
+            _child(http_requests, method, route, str(status)).inc()
+            if time.monotonic() - _caches_updated > CACHE_REFRESH_SECONDS:
+                _update_caches()
@@ -0,0 +1,109 @@
+"""
+Migra los chats directos con id aleatorio al id determinístico (services.direct_chat_id).
+
+- Si el id destino no existe, copia el chat y sus mensajes y borra el original.
+- Si ya existe (chats duplicados), mueve los mensajes al chat destino y une los
+  unread_counts (se suman) y los read_cursors (queda el más avanzado).
+- En los dos casos recalcula last_message, last_activity_at y message_count, que los
+  chats directos antiguos no tienen.
+
+Uso:
+    python migrate_direct_chats.py            # solo muestra lo que haría
+    python migrate_direct_chats.py --apply    # aplica los cambios
+
+Al terminar se puede desactivar la búsqueda de respaldo con DIRECT_CHAT_LEGACY_LOOKUP=0.
+"""
+import sys
+from firebase_config import db
+from config import COLL_CHATS, SUBCOLL_MESSAGES, LAST_MESSAGE_PREVIEW_CHARS
+from services import direct_chat_id
+
+# Límite de operaciones por WriteBatch en Firestore
+BATCH_LIMIT = 500
+
+
+def _move_messages(src_ref, dst_ref):
+    moved = 0
+    batch, ops = db.batch(), 0
+    for m in src_ref.collection(SUBCOLL_MESSAGES).stream():
+        batch.set(dst_ref.collection(SUBCOLL_MESSAGES).document(m.id), m.to_dict())
+        batch.delete(m.reference)
+        ops += 2
+        moved += 1
+        if ops >= BATCH_LIMIT:
+            batch.commit()
+            batch, ops = db.batch(), 0
+    if ops:
+        batch.commit()
+    return moved
+
+
+def _merge_read_state(dst: dict, src: dict):
+    """unread_counts sumados y, por usuario, el read_cursor más avanzado de los dos chats."""
+    unread = dict(dst.get("unread_counts") or {})
+    for user_id, n in (src.get("unread_counts") or {}).items():
+        unread[user_id] = unread.get(user_id, 0) + n
+    cursors = dict(dst.get("read_cursors") or {})
+    for user_id, cursor in (src.get("read_cursors") or {}).items():
+        current = cursors.get(user_id)
+        if not current or cursor["timestamp"] > current["timestamp"]:
+            cursors[user_id] = cursor
+    return {"unread_counts": unread, "read_cursors": cursors}
+
+
+def _recompute_summary(chat_ref, updates=None):
+    messages = chat_ref.collection(SUBCOLL_MESSAGES)
+    total = messages.count().get()[0][0].value
+    updates = dict(updates or {})
+    updates["message_count"] = int(total)
+    for last in messages.order_by("timestamp", direction="DESCENDING").limit(1).stream():
+        data = last.to_dict()
+        updates["last_message"] = {
+            "id": last.id,
+            "sender_id": data.get("sender_id"),
+            "text": (data.get("text") or "")[:LAST_MESSAGE_PREVIEW_CHARS],
+            "timestamp": data.get("timestamp"),
+        }
+        updates["last_activity_at"] = data.get("timestamp")
+    if "last_message" not in updates:
+        # Sin mensajes: la actividad es la creación del chat (como en create_direct_chat)
+        created_at = (chat_ref.get().to_dict() or {}).get("created_at")
+        updates.update({"last_message": None, "last_activity_at": created_at})
+    chat_ref.update(updates)
+
+
+def migrate(apply: bool = False):
+    stats = {"revisados": 0, "renombrados": 0, "fusionados": 0}
+    for snap in db.collection(COLL_CHATS).where("type", "==", "direct").stream():
+        stats["revisados"] += 1
+        chat = snap.to_dict()
+        users = chat.get("users") or []
+        if len(users) != 2:
+            print(f"Se omite el chat {snap.id}: no tiene 2 usuarios.")
+            continue
+        target_id = direct_chat_id(chat["project_id"], users[0], users[1])
+        if snap.id == target_id:
+            continue
+
+        dst_ref = db.collection(COLL_CHATS).document(target_id)
+        dst_snap = dst_ref.get()
+        exists = dst_snap.exists
+        action = "fusionar con" if exists else "renombrar a"
+        print(f"{snap.id} -> {action} {target_id}")
+        if not apply:
+            continue
+
+        if not exists:
+            dst_ref.set(chat)
+        moved = _move_messages(snap.reference, dst_ref)
+        _recompute_summary(dst_ref, _merge_read_state(dst_snap.to_dict(), chat) if exists else None)
+        snap.reference.delete()
+        stats["fusionados" if exists else "renombrados"] += 1
+        print(f"  {moved} mensajes movidos")
+
+    print(stats if apply else f"{stats} (simulación, usar --apply para aplicar)")
+    return stats
+
+
+if __name__ == "__main__":
+    migrate(apply="--apply" in sys.argv)
@@ -0,0 +1,145 @@
+from __future__ import annotations
+from typing import Any, Callable, Dict, Hashable, Optional
+from collections import OrderedDict
+import queue
+import threading
+import time
+
+
+# Marcador que indica a un worker que debe terminar
+_STOP = object()
+
+
+class NotificationDispatcher:
+    """
+    Cola en memoria con un pool de workers para enviar notificaciones fuera
+    del ciclo de la petición HTTP.
+
+    - enqueue() es idempotente por job_id (cada mensaje se encola una sola vez).
+    - La cola es acotada: si está llena se espera enqueue_timeout y luego se descarta (backpressure).
+      enqueue_nowait() descarta sin esperar, para no bloquear el event loop.
+    - stop() espera a que se vacíe la cola (drain) antes de detener los workers.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[..., Any],
+        workers: int = 2,
+        max_queue: int = 1000,
+        enqueue_timeout: float = 0.05,
+        dedupe_size: int = 10000,
+    ):
+        self.handler = handler
+        self.workers = max(1, int(workers))
+        self.enqueue_timeout = float(enqueue_timeout)
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max(1, int(max_queue)))
+        self._threads = []
+        self._lock = threading.Lock()
+        self._seen: "OrderedDict[Hashable, None]" = OrderedDict()
+        self._dedupe_size = max(1, int(dedupe_size))
+        self._running = False
+        self._metrics = {
+            "enqueued": 0,
+            "processed": 0,
+            "failed": 0,
+            "dropped": 0,
+            "duplicates": 0,
+            "max_depth": 0,
+        }
+
+    def start(self):
+        with self._lock:
+            if self._running:
+                return
+            self._running = True
+            self._threads = []
+            for i in range(self.workers):
+                t = threading.Thread(target=self._worker, name=f"notif-worker-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def enqueue(self, job_id: Hashable, *args, **kwargs) -> bool:
+        return self._enqueue(job_id, args, kwargs, block=True)
+
+    def enqueue_nowait(self, job_id: Hashable, *args, **kwargs) -> bool:
+        """Como enqueue, sin esperar si la cola está llena (para llamar desde el event loop)."""
+        return self._enqueue(job_id, args, kwargs, block=False)
+
+    def _enqueue(self, job_id: Hashable, args, kwargs, block: bool) -> bool:
+        if not self._running:
+            self.start()
+        with self._lock:
+            if job_id in self._seen:
+                self._metrics["duplicates"] += 1
+                return False
+            self._seen[job_id] = None
+            while len(self._seen) > self._dedupe_size:
+                self._seen.popitem(last=False)
+        try:
+            if block:
+                self._queue.put((args, kwargs), timeout=self.enqueue_timeout)
+            else:
+                self._queue.put_nowait((args, kwargs))
+        except queue.Full:
+            with self._lock:
+                self._seen.pop(job_id, None)
+                self._metrics["dropped"] += 1
+            print(f"Cola de notificaciones llena, se descarta la notificación {job_id}.")
+            return False
+        with self._lock:
+            self._metrics["enqueued"] += 1
+            depth = self._queue.qsize()
+            if depth > self._metrics["max_depth"]:
+                self._metrics["max_depth"] = depth
+        return True
+
+    def _worker(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is _STOP:
+                    return
+                args, kwargs = item
+                try:
+                    self.handler(*args, **kwargs)
+                    ok = True
+                except Exception as e:
+                    ok = False
+                    print(f"Error en el worker de notificaciones: {e}")
+                with self._lock:
+                    self._metrics["processed" if ok else "failed"] += 1
+            finally:
+                self._queue.task_done()
+
+    def stop(self, timeout: Optional[float] = 10.0):
+        """
+        Espera a que se procesen los trabajos pendientes (hasta `timeout` segundos)
+        y detiene los workers.
+        """
+        with self._lock:
+            if not self._running:
+                return
+            self._running = False
+            threads = list(self._threads)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if deadline is not None and time.monotonic() >= deadline:
+                print(f"Drain de notificaciones incompleto: {self._queue.unfinished_tasks} pendientes.")
+                break
+            time.sleep(0.01)
+        for _ in threads:
+            try:
+                self._queue.put_nowait(_STOP)
+            except queue.Full:
+                break
+        for t in threads:
+            t.join(None if deadline is None else max(0.0, deadline - time.monotonic()))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            out = dict(self._metrics)
+            out["depth"] = self._queue.qsize()
+            out["capacity"] = self._queue.maxsize
+            out["workers"] = self.workers
+            out["running"] = self._running
+            return out
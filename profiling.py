@@ -0,0 +1,152 @@
+"""
+Profiler por muestreo bajo demanda.
+
+Mientras dura una petición perfilada, un hilo toma una muestra de la pila de todos los
+hilos del proceso cada `interval` segundos (event loop, threadpool de endpoints sync y
+workers de notificaciones), descartando los hilos ociosos. El resultado se guarda en
+formato "collapsed stacks" (una línea `hilo;frame;frame;... cantidad` por pila), que
+leen flamegraph.pl, speedscope e inferno.
+
+Una petición se perfila si trae `X-Profile: 1` con el token de admin en `X-Admin-Token`,
+o al azar con probabilidad `sample_rate`. Se guardan los últimos `keep` perfiles.
+"""
+from __future__ import annotations
+from typing import Any, Dict, List, Optional
+from collections import Counter, deque
+import itertools
+import os
+import random
+import secrets
+import sys
+import threading
+import time
+
+# Pilas cuyo frame superior está en estos módulos corresponden a hilos esperando trabajo
+_IDLE_FILES = ("threading.py", "selectors.py", "queue.py")
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class Sampler:
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me or os.path.basename(frame.f_code.co_filename) in _IDLE_FILES:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+
+class ProfileStore:
+    def __init__(self, keep: int):
+        self._lock = threading.Lock()
+        self._profiles: "deque[Dict[str, Any]]" = deque(maxlen=max(1, keep))
+        self._ids = itertools.count(1)
+
+    def new_id(self) -> str:
+        return str(next(self._ids))
+
+    def add(self, profile_id: str, method: str, path: str, route: Optional[str], status: int, duration: float,
+            sampler: Sampler) -> Dict[str, Any]:
+        profile = {
+            "id": profile_id,
+            "method": method,
+            "path": path,
+            "route": route,
+            "status": status,
+            "started_at": time.time() - duration,
+            "duration_ms": round(duration * 1000, 2),
+            "samples": sampler.samples,
+            "interval_ms": sampler.interval * 1000,
+            "collapsed": "\n".join(f"{stack} {n}" for stack, n in sampler.stacks.most_common()) + "\n",
+        }
+        with self._lock:
+            self._profiles.append(profile)
+        return profile
+
+    def list(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [{k: v for k, v in p.items() if k != "collapsed"} for p in reversed(self._profiles)]
+
+    def get(self, profile_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            return next((p for p in self._profiles if p["id"] == profile_id), None)
+
+
+def check_admin_token(expected: str, token: Optional[str]) -> bool:
+    return bool(expected and token and secrets.compare_digest(expected.encode(), token.encode()))
+
+
+class ProfilingMiddleware:
+    """Middleware ASGI que perfila las peticiones elegidas y agrega X-Profile-Id a la respuesta."""
+
+    def __init__(self, app, store: ProfileStore, admin_token: str = "", sample_rate: float = 0.0,
+                 interval: float = 0.005, max_concurrent: int = 2):
+        self.app = app
+        self.store = store
+        self.admin_token = admin_token
+        self.sample_rate = sample_rate
+        self.interval = interval
+        self._slots = threading.BoundedSemaphore(max(1, max_concurrent))
+
+    def _requested(self, scope) -> bool:
+        if not self.admin_token:
+            return False
+        headers = dict(scope["headers"])
+        if headers.get(b"x-profile") != b"1":
+            return False
+        return check_admin_token(self.admin_token, headers.get(b"x-admin-token", b"").decode("latin-1"))
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        wanted = self._requested(scope) or (self.sample_rate > 0 and random.random() < self.sample_rate)
+        # Cada perfil usa un hilo de muestreo: se limita cuántos corren a la vez
+        if not wanted or not self._slots.acquire(blocking=False):
+            return await self.app(scope, receive, send)
+
+        status = 500
+        profile_id = self.store.new_id()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message = {**message, "headers": list(message.get("headers", [])) + [(b"x-profile-id", profile_id.encode())]}
+            await send(message)
+
+        sampler = Sampler(self.interval)
+        started = time.perf_counter()
+        sampler.start()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            sampler.stop()
+            self._slots.release()
+            route = getattr(scope.get("route"), "path", None)
+            self.store.add(profile_id, scope["method"], scope["path"], route, status,
+                           time.perf_counter() - started, sampler)
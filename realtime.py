@@ -0,0 +1,148 @@
+from __future__ import annotations
+from typing import Any, Callable, Dict, Hashable, Optional, Set
+from collections import OrderedDict
+import asyncio
+import threading
+
+
+# Marcador que indica al consumidor que la suscripción se cerró
+_CLOSED = object()
+
+
+class SlowConsumer(Exception):
+    """El cliente no consume los eventos al ritmo en que se publican."""
+
+
+class Subscription:
+    """
+    Suscripción a los eventos de un chat con un buffer acotado.
+    Se consume desde el event loop donde se creó; si el buffer se llena
+    la suscripción queda marcada como lenta y get() lanza SlowConsumer.
+    """
+
+    def __init__(self, chat_id: str, loop: asyncio.AbstractEventLoop, max_buffer: int):
+        self.chat_id = chat_id
+        self.loop = loop
+        self.queue: "asyncio.Queue" = asyncio.Queue(maxsize=max(1, int(max_buffer)))
+        self.closed = False
+        self.overflowed = False
+
+    def _offer(self, event: Any):
+        if self.closed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+            self._close()
+
+    def _close(self):
+        self.closed = True
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(_CLOSED)
+
+    def close(self):
+        """Cierra la suscripción (se puede llamar desde cualquier hilo)."""
+        self.loop.call_soon_threadsafe(lambda: None if self.closed else self._close())
+
+    async def get(self):
+        """Siguiente evento, o None si la suscripción se cerró."""
+        event = await self.queue.get()
+        if self.overflowed:
+            raise SlowConsumer(self.chat_id)
+        return None if event is _CLOSED else event
+
+
+class Broker:
+    """
+    Pub/sub en memoria por chat. publish() se puede llamar desde cualquier hilo
+    (por ejemplo desde los endpoints sync de FastAPI) y reparte el evento a las
+    suscripciones de cada event loop.
+
+    Opcionalmente, `listener_factory(chat_id, publish)` arranca un listener externo
+    (Firestore on_snapshot) mientras haya suscriptores del chat; debe devolver una
+    función para detenerlo. Los eventos repetidos (mismo id) se descartan.
+    """
+
+    def __init__(self, max_buffer: int = 100,
+                 listener_factory: Optional[Callable[[str, Callable[[Dict[str, Any]], None]], Callable[[], None]]] = None,
+                 dedupe_size: int = 256):
+        self.max_buffer = max_buffer
+        self.listener_factory = listener_factory
+        self._dedupe_size = dedupe_size
+        self._lock = threading.Lock()
+        self._subs: Dict[str, Set[Subscription]] = {}
+        self._listeners: Dict[str, Callable[[], None]] = {}
+        self._recent: Dict[str, "OrderedDict[Hashable, None]"] = {}
+        self._metrics = {"published": 0, "delivered": 0, "duplicates": 0, "slow_disconnects": 0}
+
+    def subscribe(self, chat_id: str) -> Subscription:
+        sub = Subscription(chat_id, asyncio.get_running_loop(), self.max_buffer)
+        start_listener = False
+        with self._lock:
+            subs = self._subs.setdefault(chat_id, set())
+            subs.add(sub)
+            if self.listener_factory and chat_id not in self._listeners:
+                self._listeners[chat_id] = None
+                start_listener = True
+        if start_listener:
+            try:
+                stop = self.listener_factory(chat_id, lambda event: self.publish(chat_id, event))
+            except Exception as e:
+                stop = None
+                print(f"No se pudo iniciar el listener del chat {chat_id}: {e}")
+            with self._lock:
+                if chat_id in self._listeners:
+                    self._listeners[chat_id] = stop
+                    stop = None
+            if stop:
+                stop()
+        return sub
+
+    def unsubscribe(self, sub: Subscription):
+        stop = None
+        with self._lock:
+            if sub.overflowed:
+                self._metrics["slow_disconnects"] += 1
+            subs = self._subs.get(sub.chat_id)
+            if subs is not None:
+                subs.discard(sub)
+                if not subs:
+                    del self._subs[sub.chat_id]
+                    self._recent.pop(sub.chat_id, None)
+                    stop = self._listeners.pop(sub.chat_id, None)
+        sub.closed = True
+        if stop:
+            stop()
+
+    def publish(self, chat_id: str, event: Dict[str, Any]):
+        with self._lock:
+            subs = list(self._subs.get(chat_id, ()))
+            if not subs:
+                return
+            event_id = event.get("id")
+            if event_id is not None:
+                recent = self._recent.setdefault(chat_id, OrderedDict())
+                if event_id in recent:
+                    self._metrics["duplicates"] += 1
+                    return
+                recent[event_id] = None
+                while len(recent) > self._dedupe_size:
+                    recent.popitem(last=False)
+            self._metrics["published"] += 1
+            self._metrics["delivered"] += len(subs)
+        for sub in subs:
+            try:
+                sub.loop.call_soon_threadsafe(sub._offer, event)
+            except RuntimeError:
+                # el event loop de la suscripción ya terminó
+                self.unsubscribe(sub)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            out = dict(self._metrics)
+            out["chats"] = len(self._subs)
+            out["subscriptions"] = sum(len(s) for s in self._subs.values())
+            out["listeners"] = len(self._listeners)
+            return out
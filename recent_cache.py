@@ -0,0 +1,217 @@
+"""
+Cache en proceso de los mensajes más recientes de cada chat (los últimos N, ordenados por
+(timestamp, id)), para servir sin Firestore las lecturas de la cola de los chats activos.
+
+- Se llena al leer la cola del chat (newest_first sin cursor) y se le agregan los mensajes
+  que escribe este proceso (add_message / add_messages).
+- Desalojo LRU entre chats con un techo global de memoria (tamaño estimado de los mensajes).
+- Invalidación entre workers: cada entrada guarda el message_count del chat con el que está
+  al día. Las lecturas ya traen el documento del chat (autenticación), y si su message_count
+  no coincide es que otro proceso escribió: la entrada queda atrasada y la siguiente lectura
+  de la cola la pone al día con los mensajes posteriores al último que tiene (stale /
+  catch_up). Si lo que llega no cuadra con el message_count, se descarta y se vuelve a llenar.
+"""
+from __future__ import annotations
+from typing import Any, Dict, List, Optional, Tuple
+from collections import OrderedDict
+from bisect import bisect_left, bisect_right
+import threading
+
+# Sobrecosto aproximado por mensaje (dict, fecha, claves) además del largo de sus textos
+_MSG_OVERHEAD = 400
+
+
+def _key(msg: Dict[str, Any]):
+    return msg["timestamp"], msg["id"]
+
+
+def _msg_size(msg: Dict[str, Any]) -> int:
+    return _MSG_OVERHEAD + sum(len(v) for v in msg.values() if isinstance(v, str))
+
+
+class _Entry:
+    __slots__ = ("messages", "keys", "version", "complete", "size")
+
+    def __init__(self, messages: List[Dict[str, Any]], version: int, complete: bool):
+        self.messages = messages
+        self.keys = [_key(m) for m in messages]
+        self.version = version
+        # True si `messages` es el historial completo del chat (no hay mensajes más antiguos)
+        self.complete = complete
+        self.size = sum(_msg_size(m) for m in messages)
+
+
+class RecentMessagesCache:
+    """
+    chat_id -> últimos `per_chat` mensajes, con desalojo LRU cuando el tamaño estimado total
+    supera `max_bytes`. Segura entre hilos.
+    """
+
+    def __init__(self, per_chat: int = 100, max_bytes: int = 64 * 1024 * 1024):
+        self.per_chat = max(1, int(per_chat))
+        self.max_bytes = max(0, int(max_bytes))
+        self._data: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.catch_ups = 0
+
+    def window(self, chat_id: str, version: Any, limit: Optional[int], cursor: Optional[Tuple],
+               descending: bool) -> Optional[List[Dict[str, Any]]]:
+        """
+        Resultado de la consulta de mensajes (en su orden, hasta limit + 1 elementos) si la
+        cache lo tiene completo; None si hay que ir a Firestore.
+        `cursor` es (timestamp, id) exclusivo: se devuelven los anteriores si `descending`
+        y los posteriores si no.
+        """
+        want = None if limit is None else limit + 1
+        with self._lock:
+            entry = self._data.get(chat_id)
+            # Una entrada atrasada se conserva para ponerla al día (catch_up)
+            if entry is None or entry.version != version:
+                self.misses += 1
+                return None
+
+            if descending:
+                end = len(entry.keys) if cursor is None else bisect_left(entry.keys, cursor)
+                start = 0 if want is None else max(0, end - want)
+                # Con menos de los pedidos, solo si no hay mensajes más antiguos fuera de la cache
+                ok = (want is not None and end - start == want) or entry.complete
+                out = entry.messages[start:end][::-1] if ok else None
+            else:
+                # Todo lo posterior a un cursor dentro de la ventana está en la cache
+                ok = entry.complete or (cursor is not None and bool(entry.keys) and cursor >= entry.keys[0])
+                start = 0 if cursor is None else bisect_right(entry.keys, cursor)
+                end = len(entry.keys) if want is None else start + want
+                out = entry.messages[start:end] if ok else None
+
+            if out is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(chat_id)
+            self.hits += 1
+            return [dict(m) for m in out]
+
+    def fill(self, chat_id: str, version: Any, newest: List[Dict[str, Any]], complete: bool):
+        """Guarda la cola del chat a partir de una consulta descendente (`newest`, más recientes primero)."""
+        if version is None:
+            return
+        messages = [dict(m) for m in reversed(newest[:self.per_chat])]
+        entry = _Entry(messages, version, complete and len(newest) <= self.per_chat)
+        with self._lock:
+            self._drop(chat_id)
+            self._data[chat_id] = entry
+            self._bytes += entry.size
+            self._evict()
+
+    def append(self, chat_id: str, version: Any, messages: List[Dict[str, Any]]):
+        """
+        Agrega mensajes recién escritos. `version` es el message_count del chat antes de la
+        escritura: si la entrada no está en esa versión se descarta (se perdió algún mensaje).
+        """
+        with self._lock:
+            entry = self._data.get(chat_id)
+            if entry is None:
+                return
+            if entry.version != version:
+                self._drop(chat_id)
+                self.invalidations += 1
+                return
+            self._insert(chat_id, entry, messages)
+
+    def stale(self, chat_id: str, version: Any) -> Optional[Tuple[Optional[Tuple], Any, int]]:
+        """
+        Si la entrada está atrasada respecto de `version` en a lo sumo `per_chat` mensajes,
+        devuelve (clave del mensaje más reciente en cache o None si no tiene ninguno, versión
+        de la entrada, mensajes que faltan); None si no hay nada que poner al día.
+        """
+        with self._lock:
+            entry = self._data.get(chat_id)
+            if entry is None or not isinstance(version, int) or (not entry.keys and not entry.complete):
+                return None
+            missing = version - entry.version
+            if not 0 < missing <= self.per_chat:
+                return None
+            return (entry.keys[-1] if entry.keys else None), entry.version, missing
+
+    def catch_up(self, chat_id: str, since: Any, version: Any, messages: List[Dict[str, Any]]) -> bool:
+        """
+        Pone al día una entrada atrasada (ver stale) con los mensajes posteriores al último que
+        tenía. Si no son exactamente los que faltan (borrados, timestamps anteriores al último
+        en cache) la entrada se descarta. Devuelve True si quedó en `version`.
+        """
+        with self._lock:
+            entry = self._data.get(chat_id)
+            if entry is None or entry.version != since:
+                return False
+            if not isinstance(version, int) or len(messages) != version - since:
+                self._drop(chat_id)
+                self.invalidations += 1
+                return False
+            self._insert(chat_id, entry, messages)
+            self.catch_ups += 1
+            return True
+
+    def _insert(self, chat_id: str, entry: _Entry, messages: List[Dict[str, Any]]):
+        for msg in messages:
+            msg = dict(msg)
+            key = _key(msg)
+            i = bisect_left(entry.keys, key)
+            if i < len(entry.keys) and entry.keys[i] == key:
+                continue
+            entry.keys.insert(i, key)
+            entry.messages.insert(i, msg)
+            size = _msg_size(msg)
+            entry.size += size
+            self._bytes += size
+        while len(entry.messages) > self.per_chat:
+            self._bytes -= _msg_size(entry.messages[0])
+            entry.size -= _msg_size(entry.messages[0])
+            del entry.messages[0], entry.keys[0]
+            entry.complete = False
+        entry.version += len(messages)
+        self._data.move_to_end(chat_id)
+        self._evict()
+
+    def invalidate(self, chat_id: str):
+        with self._lock:
+            self._drop(chat_id)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def _drop(self, chat_id: str):
+        entry = self._data.pop(chat_id, None)
+        if entry is not None:
+            self._bytes -= entry.size
+
+    def _evict(self):
+        while self._bytes > self.max_bytes and self._data:
+            _, entry = self._data.popitem(last=False)
+            self._bytes -= entry.size
+            self.evictions += 1
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "per_chat": self.per_chat,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "catch_ups": self.catch_ups,
+                "hit_ratio": (self.hits / total) if total else 0.0,
+            }
@@ -0,0 +1,120 @@
+"""
+Serialización JSON de documentos de Firestore para las respuestas de la API.
+
+- dumps(): orjson con las fechas resueltas de forma nativa. DatetimeWithNanoseconds (la
+  subclase de datetime que devuelve Firestore) pasa por `_default` y sale en ISO 8601,
+  igual que con jsonable_encoder.
+- project(): proyección opcional de campos (?fields=id,text,timestamp) sobre un documento
+  o una lista de documentos.
+- ndjson(): cuerpo NDJSON (un documento por línea) para StreamingResponse.
+- WireResponse / WireRoute: clase de respuesta y de ruta que usan todos los endpoints.
+  WireRoute serializa directamente lo que devuelve el endpoint, sin la pasada previa de
+  jsonable_encoder que FastAPI hace sobre dicts y listas.
+"""
+from __future__ import annotations
+from typing import Any, AsyncIterator, Callable, Iterable, Optional, Sequence
+from datetime import date, datetime
+from enum import Enum
+import functools
+import inspect
+
+import orjson
+from fastapi.datastructures import DefaultPlaceholder
+from fastapi.responses import Response
+from fastapi.routing import APIRoute
+from pydantic import BaseModel
+
+_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+
+def _default(value: Any):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, BaseModel):
+        return value.model_dump(mode="json")
+    if isinstance(value, (set, frozenset, tuple)):
+        return list(value)
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, bytes):
+        return value.decode("utf-8", "replace")
+    raise TypeError(f"Tipo no serializable: {type(value).__name__}")
+
+
+def dumps(value: Any) -> bytes:
+    return orjson.dumps(value, default=_default, option=_OPTIONS)
+
+
+def parse_fields(fields: Optional[str]) -> Optional[Sequence[str]]:
+    """'id, text' -> ('id', 'text'); vacío o None -> sin proyección."""
+    if not fields:
+        return None
+    names = tuple(f.strip() for f in fields.split(",") if f.strip())
+    return names or None
+
+
+def project(docs: Any, fields: Optional[Iterable[str]]):
+    """Deja solo `fields` (campos de primer nivel) en un documento o lista de documentos."""
+    if not fields:
+        return docs
+    fields = tuple(fields)
+    if isinstance(docs, dict):
+        return {k: docs[k] for k in fields if k in docs}
+    return [{k: d[k] for k in fields if k in d} for d in docs]
+
+
+NDJSON = "application/x-ndjson"
+
+
+async def ndjson(items: AsyncIterator[Any], flush_lines: int = 100) -> AsyncIterator[bytes]:
+    """Serializa `items` a medida que llegan, enviando de a `flush_lines` líneas."""
+    buf = []
+    async for item in items:
+        buf.append(dumps(item))
+        if len(buf) >= flush_lines:
+            yield b"\n".join(buf) + b"\n"
+            buf = []
+    if buf:
+        yield b"\n".join(buf) + b"\n"
+
+
+class WireResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def _wrap_endpoint(endpoint: Callable, status_code: Optional[int]) -> Callable:
+    # Al devolver una Response, FastAPI ya no aplica el status_code de la ruta: se pasa acá
+    status_code = status_code or 200
+    if inspect.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def wrapper(*args, **kwargs):
+            result = await endpoint(*args, **kwargs)
+            return result if isinstance(result, Response) else WireResponse(result, status_code)
+    else:
+        @functools.wraps(endpoint)
+        def wrapper(*args, **kwargs):
+            result = endpoint(*args, **kwargs)
+            return result if isinstance(result, Response) else WireResponse(result, status_code)
+    return wrapper
+
+
+class WireRoute(APIRoute):
+    """
+    Ruta que envuelve el endpoint para devolver WireResponse. Las rutas con
+    response_model (explícito o por anotación de retorno) mantienen la validación y
+    serialización de FastAPI.
+    """
+
+    def __init__(self, path: str, endpoint: Callable, **kwargs):
+        if _value(kwargs.get("response_model")) is None \
+                and inspect.signature(endpoint).return_annotation is inspect.Signature.empty:
+            endpoint = _wrap_endpoint(endpoint, _value(kwargs.get("status_code")))
+        super().__init__(path, endpoint, **kwargs)
+
+
+def _value(arg):
+    return arg.value if isinstance(arg, DefaultPlaceholder) else arg
+
@@ -1,17 +1,48 @@
 from __future__ import annotations
-from typing import List, Optional, Dict, Any
-from datetime import datetime, timezone
+from typing import List, Optional, Dict, Any, Tuple
+from datetime import datetime, timezone, timedelta
 from uuid import uuid4
 import secrets
-from firebase_config import db
+import hashlib
+import base64
+import json
+import time
+from firebase_config import db, transactional
 from config import COLL_PROJECTS, COLL_CHATS, SUBCOLL_MESSAGES
 from config import COLL_FCM_TOKENS
+from config import AUTH_CACHE_TTL, AUTH_CACHE_NEGATIVE_TTL, AUTH_CACHE_MAX_SIZE
+from config import NOTIF_WORKERS, NOTIF_QUEUE_MAX, NOTIF_ENQUEUE_TIMEOUT, NOTIF_DRAIN_TIMEOUT
+from config import FCM_TOKEN_BATCH_SIZE, FCM_TOKEN_CACHE_TTL, FCM_TOKEN_CACHE_NEGATIVE_TTL, FCM_TOKEN_CACHE_MAX_SIZE
+from config import FCM_MULTICAST_LIMIT, LAST_MESSAGE_PREVIEW_CHARS, DIRECT_CHAT_LEGACY_LOOKUP
+from config import REALTIME_BUFFER_SIZE, REALTIME_FIRESTORE_LISTENER
+from config import FIRESTORE_BATCH_LIMIT, FCM_ENABLED
+from config import ADMIN_SCAN_BATCH, ADMIN_SCAN_MAX, UNREAD_COUNTERS_MAX_MEMBERS
+from config import RECENT_CACHE_ENABLED, RECENT_CACHE_PER_CHAT, RECENT_CACHE_MAX_BYTES
+from cache import TTLCache, MISSING
+from recent_cache import RecentMessagesCache
+from notifications import NotificationDispatcher
+from realtime import Broker
+import metrics
 
 from firebase_admin import messaging
+from google.api_core.exceptions import AlreadyExists
+from google.cloud.firestore_v1 import Query, Increment
+from google.cloud.firestore_v1.field_path import FieldPath
 
-from config import COLL_FCM_TOKENS
 
-from firebase_admin import messaging
+# Cache de credenciales: project_id -> api_key (None si el proyecto no existe)
+_auth_cache = TTLCache(max_size=AUTH_CACHE_MAX_SIZE, ttl=AUTH_CACHE_TTL, negative_ttl=AUTH_CACHE_NEGATIVE_TTL)
+
+# Cache de tokens FCM: user_id -> token (None si el usuario no tiene token)
+_token_cache = TTLCache(max_size=FCM_TOKEN_CACHE_MAX_SIZE, ttl=FCM_TOKEN_CACHE_TTL, negative_ttl=FCM_TOKEN_CACHE_NEGATIVE_TTL)
+
+metrics.register_cache("auth", _auth_cache.stats)
+metrics.register_cache("fcm_tokens", _token_cache.stats)
+
+# Cache de los últimos mensajes por chat, validada con el message_count del chat
+_recent = RecentMessagesCache(per_chat=RECENT_CACHE_PER_CHAT, max_bytes=RECENT_CACHE_MAX_BYTES)
+
+metrics.register_cache("recent_messages", _recent.stats)
 
 
 # Helpers
@@ -29,6 +60,32 @@ def direct_pair_key(user_a: str, user_b: str):
     a, b = sorted([str(user_a), str(user_b)])
     return f"{a}:{b}"
 
+def direct_chat_id(project_id: str, user_a: str, user_b: str):
+    """
+    Id de documento determinístico para el chat directo entre dos usuarios de un proyecto.
+    Se usa un hash para que los ids de usuario con caracteres no válidos en Firestore ('/') no importen.
+    """
+    digest = hashlib.sha256(f"{project_id}|{direct_pair_key(user_a, user_b)}".encode()).hexdigest()
+    return f"direct_{digest[:40]}"
+
+def encode_cursor(ts: datetime, doc_id: str) -> str:
+    """
+    Cursor opaco (timestamp + id de documento) para paginar de forma estable.
+    """
+    raw = json.dumps({"ts": ts.isoformat(), "id": doc_id}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str):
+    """
+    Devuelve (timestamp, doc_id). Lanza ValueError si el cursor no es válido.
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+        return datetime.fromisoformat(data["ts"]), str(data["id"])
+    except Exception:
+        raise ValueError("Cursor inválido")
+
 
 # Projects CRUD
 def create_project(name: str):
@@ -42,6 +99,7 @@ def create_project(name: str):
         "updated_at": now_utc(),
     }
     db.collection(COLL_PROJECTS).document(pid).set(doc)
+    _auth_cache.set(pid, api_key)
     return doc
 
 def list_projects():
@@ -60,244 +118,836 @@ def update_project(project_id: str, name: Optional[str] = None):
     if not updates: return get_project(project_id)
     updates["updated_at"] = now_utc()
     db.collection(COLL_PROJECTS).document(project_id).update(updates)
+    _auth_cache.invalidate(project_id)
     return get_project(project_id)
 
 def delete_project(project_id: str):
     db.collection(COLL_PROJECTS).document(project_id).delete()
+    _auth_cache.invalidate(project_id)
     return True
 
+def check_project_auth(project_id: str, api_key: str, project: Any = MISSING):
+    """
+    Compara `api_key` con la del proyecto usando el cache de credenciales (compartido por las
+    versiones sync y async de validate_project_auth). Sin `project` y sin la clave en cache
+    devuelve MISSING: el llamador lee el proyecto (None si no existe) y vuelve a llamar con él.
+    """
+    if project is MISSING:
+        expected = _auth_cache.get(project_id)
+        if expected is MISSING:
+            return MISSING
+    else:
+        expected = project.get("api_key") if project else None
+        _auth_cache.set(project_id, expected)
+    return bool(expected and api_key and secrets.compare_digest(expected.encode(), api_key.encode()))
+
 def validate_project_auth(project_id: str, api_key: str):
-    proj = get_project(project_id)
-    return bool(proj and proj.get("api_key") == api_key)
+    ok = check_project_auth(project_id, api_key)
+    if ok is MISSING:
+        ok = check_project_auth(project_id, api_key, get_project(project_id))
+    return ok
+
+def auth_cache_stats():
+    """
+    Estadísticas del cache de credenciales (cada hit es una lectura de Firestore ahorrada).
+    """
+    return _auth_cache.stats()
 
 
 # Chats CRUD
 def create_direct_chat(project_id: str, user_a: str, user_b: str):
     pair = direct_pair_key(user_a, user_b)
-    existing = db.collection(COLL_CHATS)\
-        .where("project_id", "==", project_id)\
-        .where("type", "==", "direct")\
-        .where("pair_key", "==", pair)\
-        .limit(1).stream()
-
-    for doc in existing:
-        item = doc.to_dict()
-        item["id"] = doc.id
+    ref = db.collection(COLL_CHATS).document(direct_chat_id(project_id, user_a, user_b))
+
+    snap = ref.get()
+    if snap.exists:
+        item = snap.to_dict()
+        item["id"] = snap.id
         item["existed"] = True
         return item
 
+    if DIRECT_CHAT_LEGACY_LOOKUP:
+        existing = db.collection(COLL_CHATS)\
+            .where("project_id", "==", project_id)\
+            .where("type", "==", "direct")\
+            .where("pair_key", "==", pair)\
+            .limit(1).stream()
+        for doc in existing:
+            item = doc.to_dict()
+            item["id"] = doc.id
+            item["existed"] = True
+            return item
+
+    now = now_utc()
     payload = {
         "project_id": project_id,
         "type": "direct",
         "users": sorted([user_a, user_b]),
         "pair_key": pair,
-        "created_at": now_utc(),
+        "created_at": now,
+        "last_activity_at": now,
+        "last_message": None,
+        "message_count": 0,
     }
-    ref = db.collection(COLL_CHATS).add(payload)[1]
+    # create() falla si el documento ya existe: dos peticiones concurrentes no pueden duplicar el chat
+    try:
+        ref.create(payload)
+    except AlreadyExists:
+        item = ref.get().to_dict()
+        item["id"] = ref.id
+        item["existed"] = True
+        return item
     payload["id"] = ref.id
     payload["existed"] = False
     return payload
 
 def create_group_chat(project_id: str, users: List[str], title: Optional[str] = None):
+    now = now_utc()
     payload = {
         "project_id": project_id,
         "type": "group",
         "users": sorted(list(set(users))),
         "title": title,
-        "created_at": now_utc(),
+        "created_at": now,
+        "last_activity_at": now,
+        "last_message": None,
+        "message_count": 0,
     }
     ref = db.collection(COLL_CHATS).add(payload)[1]
     payload["id"] = ref.id
     return payload
 
-def list_chats(project_id: str):
-    out = []
-    qs = db.collection(COLL_CHATS).where("project_id", "==", project_id).stream()
-    for d in qs:
-        item = d.to_dict()
-        item["id"] = d.id
-        out.append(item)
-    return out
+# Campos por los que se puede ordenar el listado de chats
+CHAT_ORDER_FIELDS = {"created": "created_at", "activity": "last_activity_at"}
+
+def list_chats(project_id: str, user_id: Optional[str] = None, limit: Optional[int] = None,
+               cursor: Optional[str] = None, order: str = "created"):
+    """
+    Página de chats del proyecto, del más reciente al más antiguo según `order`
+    ("created" o "activity"). Con user_id solo devuelve los chats donde participa
+    (array_contains sobre `users`). Los índices compuestos están en firestore.indexes.json.
+    """
+    q, field = chats_query(db, project_id, user_id, limit, cursor, order)
+    page = chats_page([doc_item(d) for d in q.stream()], limit, field, user_id)
+    for chat in page["chats"]:
+        if user_id and "unread_count" not in chat:
+            total, own = unread_queries(db, chat["id"], chat, user_id)
+            chat["unread_count"] = max(0, _count(total) - _count(own))
+    return page
+
+def chats_query(client, project_id: str, user_id: Optional[str], limit: Optional[int],
+                cursor: Optional[str], order: str):
+    field = CHAT_ORDER_FIELDS.get(order)
+    if not field:
+        raise ValueError(f"Orden inválido: {order}")
+
+    q = client.collection(COLL_CHATS).where("project_id", "==", project_id)
+    if user_id:
+        q = q.where("users", "array_contains", user_id)
+    q = q.order_by(field, direction=Query.DESCENDING)\
+        .order_by(FieldPath.document_id(), direction=Query.DESCENDING)
+    if cursor:
+        ts, doc_id = decode_cursor(cursor)
+        q = q.start_after({field: ts, FieldPath.document_id(): doc_id})
+    if limit:
+        q = q.limit(limit + 1)
+    return q, field
+
+def chats_page(out: List[Dict[str, Any]], limit: Optional[int], field: str, user_id: Optional[str]):
+    has_more = bool(limit) and len(out) > limit
+    if has_more:
+        out = out[:limit]
+    next_cursor = encode_cursor(out[-1][field], out[-1]["id"]) if has_more else None
+    # Los chats sin contadores quedan sin unread_count: lo completa quien llama (unread_queries)
+    if user_id:
+        for item in out:
+            if has_unread_counters(item):
+                item["unread_count"] = (item.get("unread_counts") or {}).get(user_id, 0)
+    return {"chats": out, "next_cursor": next_cursor, "has_more": has_more}
+
+def has_unread_counters(chat: Dict[str, Any]) -> bool:
+    """Los chats con UNREAD_COUNTERS_MAX_MEMBERS miembros o más no llevan unread_counts."""
+    return len(chat.get("users") or []) < UNREAD_COUNTERS_MAX_MEMBERS
+
+def unread_queries(client, chat_id: str, chat: Dict[str, Any], user_id: str):
+    """
+    Consultas (todos, propios) de los mensajes posteriores al cursor de lectura de `user_id`:
+    los no leídos son la diferencia de sus count().
+    """
+    messages = client.collection(COLL_CHATS).document(chat_id).collection(SUBCOLL_MESSAGES)
+    cursor = (chat.get("read_cursors") or {}).get(user_id)
+    if cursor:
+        messages = messages.where("timestamp", ">", cursor["timestamp"])
+    return messages, messages.where("sender_id", "==", user_id)
+
+# Admin: listados paginados con búsqueda del lado del servidor
+def admin_scan(base, field: str, limit: int, cursor: Optional[str] = None,
+               match=None, prepare=None) -> Dict[str, Any]:
+    """
+    Página de `base` ordenada por `field` (más recientes primero) con cursor.
+    Con `match(item)` filtra en memoria: lee de a ADMIN_SCAN_BATCH documentos y como mucho
+    ADMIN_SCAN_MAX por llamada; si corta por ese límite devuelve has_more con el cursor en el
+    último documento revisado. `prepare(items)` se llama con cada lote antes de filtrar.
+    """
+    q = base.order_by(field, direction=Query.DESCENDING)\
+        .order_by(FieldPath.document_id(), direction=Query.DESCENDING)
+    after = decode_cursor(cursor) if cursor else None
+    batch_size = ADMIN_SCAN_BATCH if match else limit + 1
+    out, scanned = [], 0
+    while True:
+        page = q.start_after({field: after[0], FieldPath.document_id(): after[1]}) if after else q
+        items = [doc_item(d) for d in page.limit(batch_size).stream()]
+        if prepare and items:
+            prepare(items)
+        for item in items:
+            scanned += 1
+            if match is None or match(item):
+                out.append(item)
+                if len(out) > limit:
+                    out = out[:limit]
+                    return {"items": out, "next_cursor": encode_cursor(out[-1][field], out[-1]["id"]), "has_more": True}
+        if len(items) < batch_size:
+            return {"items": out, "next_cursor": None, "has_more": False}
+        after = (items[-1][field], items[-1]["id"])
+        if scanned >= ADMIN_SCAN_MAX:
+            return {"items": out, "next_cursor": encode_cursor(*after), "has_more": True}
+
+def admin_list_projects(q: Optional[str], limit: int, cursor: Optional[str] = None):
+    """Proyectos sin la API key (se pide por proyecto con GET /projects/{pid} cuando hace falta)."""
+    term = (q or "").strip().lower()
+    match = (lambda p: term in (p.get("name") or "").lower() or term in p["id"].lower()) if term else None
+    page = admin_scan(db.collection(COLL_PROJECTS), "created_at", limit, cursor, match)
+    for p in page["items"]:
+        p.pop("api_key", None)
+    return {"projects": page.pop("items"), **page}
+
+def admin_list_chats(project_id: Optional[str], q: Optional[str], limit: int, cursor: Optional[str] = None):
+    """Chats de todos los proyectos (o de uno) con project_name; busca por proyecto, usuarios o id."""
+    base = db.collection(COLL_CHATS)
+    if project_id:
+        base = base.where("project_id", "==", project_id)
+    names: Dict[str, str] = {}
+
+    def add_project_names(items):
+        missing = {c.get("project_id") for c in items} - names.keys() - {None}
+        if missing:
+            refs = [db.collection(COLL_PROJECTS).document(pid) for pid in missing]
+            for snap in db.get_all(refs):
+                names[snap.id] = (snap.to_dict() or {}).get("name", "sin-nombre") if snap.exists else "sin-nombre"
+        for c in items:
+            c["project_uuid"] = c.get("project_id")
+            c["project_name"] = names.get(c.get("project_id"), "sin-nombre")
+
+    term = (q or "").strip().lower()
+    match = None
+    if term:
+        def match(c):
+            return (term in c["project_name"].lower() or term in c["id"].lower()
+                    or term in (c.get("project_id") or "").lower()
+                    or any(term in u.lower() for u in c.get("users") or []))
+    page = admin_scan(base, "created_at", limit, cursor, match, add_project_names)
+    return {"chats": page.pop("items"), **page}
 
 def get_chat(chat_id: str):
     snap = db.collection(COLL_CHATS).document(chat_id).get()
     if not snap.exists: return None
+    return doc_item(snap)
+
+def doc_item(snap):
     item = snap.to_dict()
     item["id"] = snap.id
     return item
 
 
 # Messages
-def add_message(chat_id: str, sender_id: str, text: str):
+def add_message(chat_id: str, sender_id: str, text: str, chat: Optional[Dict[str, Any]] = None):
+    if chat is None:
+        chat = get_chat(chat_id) or {}
+    batch, msg, summary = prepare_message(db, chat_id, sender_id, text, chat)
+    batch.commit()
+    message_written(chat_id, msg, summary, chat)
+    return msg
+
+def prepare_message(client, chat_id: str, sender_id: str, text: str, chat: Dict[str, Any]):
+    """
+    Arma el batch con el mensaje, el resumen del chat y los no leídos (se escriben de forma atómica).
+    """
     msg = {
         "sender_id": sender_id,
         "text": text,
         "timestamp": now_utc(),
     }
-    ref = db.collection(COLL_CHATS).document(chat_id).collection(SUBCOLL_MESSAGES).add(msg)[1]
+    chat_ref = client.collection(COLL_CHATS).document(chat_id)
+    ref = chat_ref.collection(SUBCOLL_MESSAGES).document()
+    unread = {u: 1 for u in chat.get("users", []) if u != sender_id} if has_unread_counters(chat) else None
+    summary = chat_summary_update(msg["sender_id"], msg["text"], msg["timestamp"], ref.id, unread=unread)
+    batch = client.batch()
+    batch.set(ref, msg)
+    batch.update(chat_ref, summary)
     msg["id"] = ref.id
+    return batch, msg, summary
 
-###################### logica notificaciones inicio
-
-    # Get the project_id to pass to the notification function
-    chat_doc = db.collection(COLL_CHATS).document(chat_id).get()
-    project_id = chat_doc.to_dict().get("project_id", "N/A")
-
-    # Call the new notification function after the message is saved
-    send_push_notification(sender_id, chat_id, project_id)
-
-###################### logica notificaciones fin
-
-
-###################### logica notificaciones inicio
-
-    # Get the project_id to pass to the notification function
-    chat_doc = db.collection(COLL_CHATS).document(chat_id).get()
-    project_id = chat_doc.to_dict().get("project_id", "N/A")
-
-    # Call the new notification function after the message is saved
-    send_push_notification(sender_id, chat_id, project_id)
-
-###################### logica notificaciones fin
-
-    return msg
+def prepare_messages(client, chat_id: str, entries: List[Tuple[str, str]], members: List[str], base: datetime):
+    """
+    Como prepare_message para varios mensajes (sender_id, text) de un chat: un solo batch con
+    timestamps crecientes desde `base` y una única actualización del resumen del chat.
+    Devuelve (batch, msgs, summary).
+    """
+    chat_ref = client.collection(COLL_CHATS).document(chat_id)
+    batch = client.batch()
+    msgs = []
+    unread: Dict[str, int] = {}
+    counters = has_unread_counters({"users": members})
+    for offset, (sender_id, text) in enumerate(entries):
+        ref = chat_ref.collection(SUBCOLL_MESSAGES).document()
+        msg = {"sender_id": sender_id, "text": text, "timestamp": base + timedelta(microseconds=offset)}
+        batch.set(ref, msg)
+        msg["id"] = ref.id
+        msgs.append(msg)
+        for u in members if counters else ():
+            if u != sender_id:
+                unread[u] = unread.get(u, 0) + 1
+    last = msgs[-1]
+    summary = chat_summary_update(last["sender_id"], last["text"], last["timestamp"], last["id"],
+                                  count=len(msgs), unread=unread)
+    batch.update(chat_ref, summary)
+    return batch, msgs, summary
+
+def message_written(chat_id: str, msg: Dict[str, Any], summary: Dict[str, Any], chat: Dict[str, Any],
+                    from_event_loop: bool = False):
+    _recent.append(chat_id, recent_version(chat), [msg])
+    broker.publish(chat_id, message_event(chat_id, msg))
+    broker.publish(chat_id, chat_event(chat_id, summary))
+
+    # Las notificaciones se encolan (una sola vez por mensaje) y se envían en segundo plano,
+    # así la respuesta HTTP solo espera la escritura del mensaje. Desde el event loop no se
+    # espera lugar en la cola: si está llena la notificación se descarta (y se cuenta).
+    project_id = chat.get("project_id", "N/A") if chat else None
+    enqueue = _notifier.enqueue_nowait if from_event_loop else _notifier.enqueue
+    enqueue(msg["id"], msg["sender_id"], chat_id, project_id, chat_data=chat or None)
+
+def group_written(chat_id: str, msgs: List[Dict[str, Any]], summary: Dict[str, Any], chats: List[Dict[str, Any]]):
+    """
+    Después de un commit agrupado (group_commit.py): cada mensaje se publica y se notifica
+    como en message_written, con el chat que leyó su petición; el resumen se publica una vez.
+    """
+    versions = [recent_version(c) for c in chats]
+    _recent.append(chat_id, None if None in versions else max(versions), msgs)
+    for msg, chat in zip(msgs, chats):
+        broker.publish(chat_id, message_event(chat_id, msg))
+        project_id = chat.get("project_id", "N/A") if chat else None
+        _notifier.enqueue_nowait(msg["id"], msg["sender_id"], chat_id, project_id, chat_data=chat or None)
+    broker.publish(chat_id, chat_event(chat_id, summary))
+
+def add_messages(chat_id: str, items: List[Dict[str, Any]], chat: Optional[Dict[str, Any]] = None):
+    """
+    Escribe varios mensajes en un chat. Los mensajes se agrupan en WriteBatch
+    (hasta FIRESTORE_BATCH_LIMIT operaciones) y cada batch actualiza el resumen del chat
+    una sola vez. Se envía una única notificación por lote a quienes recibieron mensajes.
 
-def list_messages(chat_id: str):
-    out = []
-    q = db.collection(COLL_CHATS).document(chat_id).collection(SUBCOLL_MESSAGES).order_by("timestamp").stream()
-    for d in q:
-        item = d.to_dict()
-        item["id"] = d.id
-        out.append(item)
-    return out
+    Devuelve un resultado por item: {"index", "ok", "id"} o {"index", "ok": False, "error"}.
+    """
+    if chat is None:
+        chat = get_chat(chat_id) or {}
+    members = chat.get("users", [])
+
+    results: List[Optional[Dict[str, Any]]] = [None] * len(items)
+    valid = []
+    for i, item in enumerate(items):
+        sender_id, text = item.get("sender_id"), item.get("text")
+        if not sender_id or not text:
+            results[i] = {"index": i, "ok": False, "error": "sender_id y text son obligatorios"}
+        else:
+            valid.append((i, sender_id, text))
+
+    # Timestamps crecientes para conservar el orden del lote
+    base = now_utc()
+    version = recent_version(chat)
+    written = []
+    chunk_size = FIRESTORE_BATCH_LIMIT - 1
+    for start in range(0, len(valid), chunk_size):
+        chunk = valid[start:start + chunk_size]
+        batch, chunk_msgs, summary = prepare_messages(db, chat_id, [(sender_id, text) for _, sender_id, text in chunk],
+                                                      members, base + timedelta(microseconds=start))
+        msgs = [(i, msg) for (i, _, _), msg in zip(chunk, chunk_msgs)]
+        try:
+            batch.commit()
+        except Exception as e:
+            for i, _ in msgs:
+                results[i] = {"index": i, "ok": False, "error": str(e)}
+            _recent.invalidate(chat_id)
+            version = None
+            continue
+        _recent.append(chat_id, version, [msg for _, msg in msgs])
+        if version is not None:
+            version += len(msgs)
+        for i, msg in msgs:
+            results[i] = {"index": i, "ok": True, "id": msg["id"], "timestamp": msg["timestamp"]}
+            written.append(msg)
+            broker.publish(chat_id, message_event(chat_id, msg))
+        broker.publish(chat_id, chat_event(chat_id, summary))
+
+    if written:
+        senders = {m["sender_id"] for m in written}
+        recipients = [u for u in members if any(s != u for s in senders)]
+        _notifier.enqueue(f"batch:{written[0]['id']}", None, chat_id, chat.get("project_id", "N/A"),
+                          chat_data=chat, recipients=recipients, count=len(written))
+    return results
+
+def add_messages_multi(project_id: str, items: List[Dict[str, Any]]):
+    """
+    Variante de add_messages para varios chats: los chats se leen con un solo get_all,
+    se valida que pertenezcan al proyecto y se escribe un lote por chat.
+    """
+    results: List[Optional[Dict[str, Any]]] = [None] * len(items)
+    by_chat: Dict[str, List[int]] = {}
+    for i, item in enumerate(items):
+        chat_id = item.get("chat_id")
+        if not chat_id:
+            results[i] = {"index": i, "ok": False, "error": "chat_id es obligatorio"}
+        else:
+            by_chat.setdefault(chat_id, []).append(i)
+
+    chats = {}
+    if by_chat:
+        for snap in db.get_all([db.collection(COLL_CHATS).document(c) for c in by_chat]):
+            if snap.exists:
+                chats[snap.id] = dict(snap.to_dict(), id=snap.id)
+
+    for chat_id, indexes in by_chat.items():
+        chat = chats.get(chat_id)
+        if not chat or chat.get("project_id") != project_id:
+            for i in indexes:
+                results[i] = {"index": i, "ok": False, "error": "Chat no encontrado"}
+            continue
+        for i, res in zip(indexes, add_messages(chat_id, [items[i] for i in indexes], chat=chat)):
+            res["index"] = i
+            res["chat_id"] = chat_id
+            results[i] = res
+    return results
+
+def chat_summary_update(sender_id: str, text: str, timestamp: datetime, message_id: str, count: int = 1,
+                        unread: Optional[Dict[str, int]] = None):
+    """
+    Campos denormalizados del chat que se actualizan con cada mensaje nuevo.
+    `unread` es {user_id: cantidad} a sumar en unread_counts.
+    """
+    updates = {
+        "last_message": {
+            "id": message_id,
+            "sender_id": sender_id,
+            "text": text[:LAST_MESSAGE_PREVIEW_CHARS],
+            "timestamp": timestamp,
+        },
+        "last_activity_at": timestamp,
+        "message_count": Increment(count),
+    }
+    for user_id, n in (unread or {}).items():
+        updates[db.field_path("unread_counts", user_id)] = Increment(n)
+    return updates
 
+def list_messages(chat_id: str, limit: Optional[int] = None, before: Optional[str] = None,
+                  after: Optional[str] = None, newest_first: bool = False, chat: Optional[Dict[str, Any]] = None):
+    """
+    Página de mensajes ordenada por (timestamp, id).
 
+    - after:  mensajes posteriores al cursor; before: mensajes anteriores al cursor.
+    - Sin cursor se empieza por el más antiguo, o por el más reciente si newest_first.
+    - next_cursor continúa en la misma dirección de la consulta: se envía como `after`
+      si la página avanzó hacia adelante y como `before` si avanzó hacia atrás.
+    - Con `chat` (el documento ya leído) la página puede salir de la cache de mensajes recientes.
+    """
+    page = recent_messages_page(chat_id, chat, limit, before, after, newest_first)
+    if page is not None:
+        return page
+    catch_up = recent_catch_up_query(db, chat_id, chat, limit, before, after, newest_first)
+    if catch_up is not None:
+        q, since = catch_up
+        recent_catch_up(chat_id, chat, since, [doc_item(d) for d in q.stream()])
+        page = recent_messages_page(chat_id, chat, limit, before, after, newest_first)
+        if page is not None:
+            return page
+    fill = recent_fill_limit(chat, limit, before, after, newest_first)
+    q, descending, cursor = messages_query(db, chat_id, fill or limit, before, after, newest_first)
+    out = [doc_item(d) for d in q.stream()]
+    if fill:
+        recent_fill(chat_id, chat, out, fill)
+    return messages_page(out, limit, descending, newest_first, cursor)
+
+def messages_query(client, chat_id: str, limit: Optional[int], before: Optional[str],
+                   after: Optional[str], newest_first: bool):
+    if before and after:
+        raise ValueError("Usa solo uno de before/after")
+
+    if after:
+        descending = False
+    elif before:
+        descending = True
+    else:
+        descending = newest_first
+    direction = Query.DESCENDING if descending else Query.ASCENDING
+
+    q = client.collection(COLL_CHATS).document(chat_id).collection(SUBCOLL_MESSAGES)\
+        .order_by("timestamp", direction=direction)\
+        .order_by(FieldPath.document_id(), direction=direction)
+    cursor = after or before
+    if cursor:
+        ts, doc_id = decode_cursor(cursor)
+        q = q.start_after({"timestamp": ts, FieldPath.document_id(): doc_id})
+    if limit:
+        q = q.limit(limit + 1)
+    return q, descending, cursor
+
+def messages_page(out: List[Dict[str, Any]], limit: Optional[int], descending: bool, newest_first: bool,
+                  cursor: Optional[str]):
+    has_more = bool(limit) and len(out) > limit
+    if has_more:
+        out = out[:limit]
+    next_cursor = encode_cursor(out[-1]["timestamp"], out[-1]["id"]) if out else cursor
+
+    # El orden de salida es el pedido (newest_first), no necesariamente el de la consulta
+    if descending != newest_first:
+        out.reverse()
+    return {
+        "messages": out,
+        "next_cursor": next_cursor,
+        "next_cursor_param": "before" if descending else "after",
+        "has_more": has_more,
+    }
 
 
+# Cache de mensajes recientes: solo se usa con el documento del chat, cuyo message_count
+# indica si la entrada está al día (otro worker pudo haber escrito)
+def recent_version(chat: Optional[Dict[str, Any]]):
+    if not RECENT_CACHE_ENABLED or not chat:
+        return None
+    count = chat.get("message_count")
+    return count if isinstance(count, int) else None
+
+def recent_messages_page(chat_id: str, chat: Optional[Dict[str, Any]], limit: Optional[int],
+                         before: Optional[str], after: Optional[str], newest_first: bool):
+    """Página de list_messages servida desde la cache, o None si no la tiene completa."""
+    version = recent_version(chat)
+    if version is None or (before and after):
+        return None
+    cursor = after or before
+    descending = bool(before) or (not after and newest_first)
+    out = _recent.window(chat_id, version, limit, decode_cursor(cursor) if cursor else None, descending)
+    if out is None:
+        return None
+    return messages_page(out, limit, descending, newest_first, cursor)
+
+def recent_fill_limit(chat: Optional[Dict[str, Any]], limit: Optional[int], before: Optional[str],
+                      after: Optional[str], newest_first: bool) -> Optional[int]:
+    """
+    En una lectura de la cola (newest_first sin cursor) se consulta la ventana completa de la
+    cache para llenarla; en el resto de las lecturas, None.
+    """
+    if recent_version(chat) is None or not newest_first or before or after or not limit:
+        return None
+    return max(limit, _recent.per_chat)
 
+def recent_catch_up_query(client, chat_id: str, chat: Optional[Dict[str, Any]], limit: Optional[int],
+                          before: Optional[str], after: Optional[str], newest_first: bool):
+    """
+    En una lectura de la cola con la entrada de la cache atrasada (otro worker escribió), la
+    consulta de los mensajes posteriores al último en cache y la versión de la entrada; None
+    si no aplica. Lee solo los mensajes que faltan en vez de volver a llenar la ventana.
+    """
+    if recent_fill_limit(chat, limit, before, after, newest_first) is None:
+        return None
+    stale = _recent.stale(chat_id, recent_version(chat))
+    if stale is None:
+        return None
+    newest, since, missing = stale
+    cursor = encode_cursor(*newest) if newest else None
+    q, _, _ = messages_query(client, chat_id, missing, None, cursor, False)
+    return q, since
+
+def recent_catch_up(chat_id: str, chat: Dict[str, Any], since: int, messages: List[Dict[str, Any]]):
+    # La consulta pide missing + 1: si vino de más, la entrada se descarta y se llena de nuevo
+    _recent.catch_up(chat_id, since, recent_version(chat), messages)
+
+def recent_fill(chat_id: str, chat: Dict[str, Any], out: List[Dict[str, Any]], fetch_limit: int):
+    # La consulta pide fetch_limit + 1: si vino menos, es el historial completo
+    _recent.fill(chat_id, recent_version(chat), out, complete=len(out) <= fetch_limit)
+
+def recent_cache_stats():
+    return _recent.stats()
+
+
+# Sincronización
+def sync_user(project_id: str, user_id: str, cursors: Dict[str, Optional[str]], since: Optional[datetime] = None,
+              per_chat_limit: int = 100, continuation: Optional[str] = None, max_chats: int = 100):
+    """
+    Delta de todos los chats del usuario en una sola llamada.
 
+    Recorre los chats del usuario por última actividad (list_chats) hasta llegar a `since` y,
+    solo para los que tuvieron actividad posterior a su cursor, devuelve el chat y trae los
+    mensajes nuevos (list_messages con after=cursor, hasta per_chat_limit).
 
+    Si has_more es true el cliente repite la llamada con los cursores devueltos y la
+    continuation, manteniendo el mismo `since`. Mientras algún chat de la página tenga
+    mensajes pendientes la continuation no avanza.
+    """
+    if since and since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    page = list_chats(project_id, user_id=user_id, limit=max_chats, cursor=continuation, order="activity")
+
+    changed, messages, new_cursors = [], {}, {}
+    pending = False
+    reached_since = False
+    for chat in page["chats"]:
+        activity = chat.get("last_activity_at")
+        if since and activity and activity <= since:
+            reached_since = True
+            break
+        # Solo los chats con actividad posterior a su cursor: el resto ya está al día
+        cursor = cursors.get(chat["id"])
+        if cursor and activity and decode_cursor(cursor)[0] >= activity:
+            continue
+        changed.append(chat)
+        result = list_messages(chat["id"], limit=per_chat_limit, after=cursor, chat=chat)
+        if result["messages"]:
+            messages[chat["id"]] = result["messages"]
+            new_cursors[chat["id"]] = result["next_cursor"]
+        pending = pending or result["has_more"]
+
+    if pending:
+        next_continuation = continuation
+    elif page["has_more"] and not reached_since:
+        next_continuation = page["next_cursor"]
+    else:
+        next_continuation = None
+    return {
+        "chats": changed,
+        "messages": messages,
+        "cursors": new_cursors,
+        "has_more": pending or next_continuation is not None,
+        "continuation": next_continuation,
+        "synced_at": now_utc(),
+    }
 
 
+# Tiempo real
+def message_event(chat_id: str, msg: Dict[str, Any]):
+    """
+    Evento publicado a los suscriptores de un chat. El id es el cursor del mensaje.
+    """
+    return {
+        "id": encode_cursor(msg["timestamp"], msg["id"]),
+        "type": "message",
+        "chat_id": chat_id,
+        "data": msg,
+    }
 
+def chat_event(chat_id: str, summary: Dict[str, Any]):
+    """
+    Evento con el resumen actualizado del chat (sin id: no sirve como punto de reanudación).
+    """
+    return {
+        "type": "chat",
+        "chat_id": chat_id,
+        "data": {k: summary[k] for k in ("last_message", "last_activity_at") if k in summary},
+    }
 
+def _watch_messages(chat_id: str, publish):
+    """
+    Listener de Firestore para los mensajes nuevos del chat escritos por otros workers.
+    """
+    def on_snapshot(docs, changes, read_time):
+        for change in changes:
+            if change.type.name == "ADDED":
+                item = change.document.to_dict()
+                item["id"] = change.document.id
+                publish(message_event(chat_id, item))
 
+    watch = db.collection(COLL_CHATS).document(chat_id).collection(SUBCOLL_MESSAGES)\
+        .where("timestamp", ">=", now_utc()).on_snapshot(on_snapshot)
+    return watch.unsubscribe
 
+broker = Broker(
+    max_buffer=REALTIME_BUFFER_SIZE,
+    listener_factory=_watch_messages if REALTIME_FIRESTORE_LISTENER else None,
+)
 
+def realtime_stats():
+    return broker.stats()
 
 
+# Estado de lectura
+def _count(query, transaction=None) -> int:
+    result = query.count().get(transaction=transaction)
+    return int(result[0][0].value) if result else 0
 
-# A new function to handle sending the notifications
-def send_push_notification(sender_id: str, chat_id: str, project_id: str):
+def mark_chat_read(chat_id: str, user_id: str, message_id: Optional[str] = None,
+                   chat: Optional[Dict[str, Any]] = None):
+    """
+    Avanza el cursor de lectura de `user_id` en el chat (nunca lo retrocede).
+    Sin message_id se marca como leído hasta el último mensaje y el contador queda en 0.
+    Con message_id los no leídos se recalculan con agregaciones count(), sin traer mensajes.
+    En los chats sin contadores (has_unread_counters) no se escribe unread_counts.
+    La comparación con el cursor actual y la escritura van en una transacción, así dos
+    llamadas concurrentes (o un mensaje nuevo con su Increment) no se pisan.
+    `chat` (el documento ya leído por el endpoint) evita la transacción si el cursor ya está adelante.
+    Devuelve {"read_cursor": ..., "unread_count": ...} o None si el mensaje no existe.
+    """
+    chat_ref = db.collection(COLL_CHATS).document(chat_id)
+    cursor_path = db.field_path("read_cursors", user_id)
+    unread_path = db.field_path("unread_counts", user_id)
+
+    if message_id is None:
+        @transactional
+        def _mark_latest(transaction):
+            snap = chat_ref.get(transaction=transaction)
+            data = snap.to_dict() or {}
+            last = data.get("last_message")
+            cursor = {"message_id": last["id"], "timestamp": last["timestamp"], "updated_at": now_utc()} if last else None
+            updates = {unread_path: 0} if has_unread_counters(data) else {}
+            if cursor:
+                updates[cursor_path] = cursor
+            if updates:
+                transaction.update(chat_ref, updates)
+            return cursor
+
+        cursor = _mark_latest(db.transaction())
+        return {"read_cursor": cursor, "unread_count": 0}
+
+    msg_snap = chat_ref.collection(SUBCOLL_MESSAGES).document(message_id).get()
+    if not msg_snap.exists:
+        return None
+    ts = msg_snap.to_dict()["timestamp"]
+
+    def _current(data, transaction=None):
+        current = (data.get("read_cursors") or {}).get(user_id)
+        if not current or current["timestamp"] < ts:
+            return None
+        if has_unread_counters(data):
+            unread = (data.get("unread_counts") or {}).get(user_id, 0)
+        else:
+            total, own = unread_queries(db, chat_id, data, user_id)
+            unread = max(0, _count(total, transaction) - _count(own, transaction))
+        return {"read_cursor": current, "unread_count": unread}
+
+    if chat is not None:
+        result = _current(chat)
+        if result:
+            return result
+
+    @transactional
+    def _mark_message(transaction):
+        data = chat_ref.get(transaction=transaction).to_dict() or {}
+        result = _current(data, transaction)
+        if result:
+            return result
+        messages = chat_ref.collection(SUBCOLL_MESSAGES).where("timestamp", ">", ts)
+        unread = max(0, _count(messages, transaction) - _count(messages.where("sender_id", "==", user_id), transaction))
+        cursor = {"message_id": message_id, "timestamp": ts, "updated_at": now_utc()}
+        updates = {cursor_path: cursor}
+        if has_unread_counters(data):
+            updates[unread_path] = unread
+        transaction.update(chat_ref, updates)
+        return {"read_cursor": cursor, "unread_count": unread}
+
+    return _mark_message(db.transaction())
+
+
+# Notificaciones push
+def send_push_notification(sender_id: Optional[str], chat_id: str, project_id: Optional[str] = None,
+                           chat_data: Optional[Dict[str, Any]] = None,
+                           recipients: Optional[List[str]] = None, count: int = 1):
     try:
-        chat_doc = db.collection(COLL_CHATS).document(chat_id).get()
-        if not chat_doc.exists:
-            print(f"Error: Chat with ID {chat_id} not found.")
-            return
-
-        chat_data = chat_doc.to_dict()
-        chat_members = chat_data.get("users", [])
-
-        fcm_tokens = []
-        for user_id in chat_members:
-            if user_id != sender_id:
-                token_doc = db.collection(COLL_FCM_TOKENS).document(user_id).get()
-                if token_doc.exists:
-                    fcm_tokens.append(token_doc.to_dict()["token"])
+        if chat_data is None:
+            chat_doc = db.collection(COLL_CHATS).document(chat_id).get()
+            if not chat_doc.exists:
+                print(f"Error: Chat with ID {chat_id} not found.")
+                return
+            chat_data = chat_doc.to_dict()
+        if project_id is None:
+            project_id = chat_data.get("project_id", "N/A")
+
+        if recipients is None:
+            chat_members = chat_data.get("users", [])
+            recipients = [u for u in chat_members if u != sender_id]
+        fcm_tokens = list(get_fcm_tokens(recipients).values())
 
         if not fcm_tokens:
             print("No tokens found to send notifications.")
             return
+        if not FCM_ENABLED:
+            return
 
-        message = messaging.MulticastMessage(
-            tokens=fcm_tokens,
-            notification=messaging.Notification(
-                title=f"New message in {chat_data.get('title', 'your chat')}",
-                body="You've received a new message.",
-            ),
-            data={"chat_id": chat_id, "project_id": project_id},
-        )
-        response = messaging.send_each_for_multicast(message)
-        print(f"Notifications sent successfully: {response.success_count}")
+        success_count = 0
+        for i in range(0, len(fcm_tokens), FCM_MULTICAST_LIMIT):
+            message = messaging.MulticastMessage(
+                tokens=fcm_tokens[i:i + FCM_MULTICAST_LIMIT],
+                notification=messaging.Notification(
+                    title=f"New message in {chat_data.get('title') or 'your chat'}",
+                    body="You've received a new message." if count == 1 else f"You've received {count} new messages.",
+                ),
+                data={"chat_id": chat_id, "project_id": project_id},
+            )
+            started = time.perf_counter()
+            try:
+                response = messaging.send_each_for_multicast(message)
+            except Exception:
+                metrics.observe_fcm_send(time.perf_counter() - started, 0, len(message.tokens))
+                raise
+            metrics.observe_fcm_send(time.perf_counter() - started, response.success_count, response.failure_count)
+            success_count += response.success_count
+        print(f"Notifications sent successfully: {success_count}")
 
     except Exception as e:
         print(f"An error occurred while sending notifications: {e}")
 
 
-
-
-
-
-def save_fcm_token_to_db(user_uuid: str, token: str):
+def get_fcm_tokens(user_ids: List[str]) -> Dict[str, str]:
     """
-    Guarda el token de notificaciones push de un usuario en la base de datos.
+    Devuelve {user_id: token} para los usuarios que tienen token registrado.
+    Usa el cache de tokens y resuelve los faltantes con lecturas agrupadas (get_all)
+    de a FCM_TOKEN_BATCH_SIZE documentos.
     """
-    try:
-        db.collection("fcm_tokens").document(user_uuid).set({
-            "token": token,
-            "timestamp": now_utc()
-        })
-        print(f"Token FCM guardado con éxito para el usuario {user_uuid}.")
-        return True
-    except Exception as e:
-        print(f"Error al guardar el token FCM para el usuario {user_uuid}: {e}")
-        return False
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-# A new function to handle sending the notifications
-def send_push_notification(sender_id: str, chat_id: str, project_id: str):
-    try:
-        chat_doc = db.collection(COLL_CHATS).document(chat_id).get()
-        if not chat_doc.exists:
-            print(f"Error: Chat with ID {chat_id} not found.")
-            return
-
-        chat_data = chat_doc.to_dict()
-        chat_members = chat_data.get("users", [])
-
-        fcm_tokens = []
-        for user_id in chat_members:
-            if user_id != sender_id:
-                token_doc = db.collection(COLL_FCM_TOKENS).document(user_id).get()
-                if token_doc.exists:
-                    fcm_tokens.append(token_doc.to_dict()["token"])
-
-        if not fcm_tokens:
-            print("No tokens found to send notifications.")
-            return
+    out = {}
+    pending = []
+    for user_id in dict.fromkeys(user_ids):
+        token = _token_cache.get(user_id)
+        if token is MISSING:
+            pending.append(user_id)
+        elif token:
+            out[user_id] = token
+
+    for i in range(0, len(pending), FCM_TOKEN_BATCH_SIZE):
+        refs = [db.collection(COLL_FCM_TOKENS).document(u) for u in pending[i:i + FCM_TOKEN_BATCH_SIZE]]
+        for snap in db.get_all(refs):
+            token = (snap.to_dict() or {}).get("token") if snap.exists else None
+            _token_cache.set(snap.id, token)
+            if token:
+                out[snap.id] = token
+    return out
 
-        message = messaging.MulticastMessage(
-            tokens=fcm_tokens,
-            notification=messaging.Notification(
-                title=f"New message in {chat_data.get('title', 'your chat')}",
-                body="You've received a new message.",
-            ),
-            data={"chat_id": chat_id, "project_id": project_id},
-        )
-        response = messaging.send_each_for_multicast(message)
-        print(f"Notifications sent successfully: {response.success_count}")
+def fcm_token_cache_stats():
+    return _token_cache.stats()
 
-    except Exception as e:
-        print(f"An error occurred while sending notifications: {e}")
 
+# Dispatcher en segundo plano para send_push_notification
+_notifier = NotificationDispatcher(
+    send_push_notification,
+    workers=NOTIF_WORKERS,
+    max_queue=NOTIF_QUEUE_MAX,
+    enqueue_timeout=NOTIF_ENQUEUE_TIMEOUT,
+)
 
+def start_notification_workers():
+    _notifier.start()
 
+def stop_notification_workers():
+    """
+    Procesa las notificaciones pendientes antes de apagar (hasta NOTIF_DRAIN_TIMEOUT segundos).
+    """
+    _notifier.stop(timeout=NOTIF_DRAIN_TIMEOUT)
 
+def notification_queue_stats():
+    return _notifier.stats()
 
 
 def save_fcm_token_to_db(user_uuid: str, token: str):
@@ -305,12 +955,13 @@ def save_fcm_token_to_db(user_uuid: str, token: str):
     Guarda el token de notificaciones push de un usuario en la base de datos.
     """
     try:
-        db.collection("fcm_tokens").document(user_uuid).set({
+        db.collection(COLL_FCM_TOKENS).document(user_uuid).set({
             "token": token,
             "timestamp": now_utc()
         })
+        _token_cache.set(user_uuid, token)
         print(f"Token FCM guardado con éxito para el usuario {user_uuid}.")
         return True
     except Exception as e:
         print(f"Error al guardar el token FCM para el usuario {user_uuid}: {e}")
-        return False
\ No newline at end of file
+        return False
@@ -0,0 +1,93 @@
+// Utilidades compartidas por las páginas de admin (/proyectos, /chatsConfig, /mensajes)
+
+function escapeHtml(value) {
+  return String(value ?? "").replace(/[&<>"']/g, c => ({
+    "&": "&amp;", "<": "&lt;", ">": "&gt;", '"': "&quot;", "'": "&#39;"
+  }[c]));
+}
+
+function debounce(fn, ms) {
+  let timer = null;
+  return (...args) => {
+    clearTimeout(timer);
+    timer = setTimeout(() => fn(...args), ms);
+  };
+}
+
+// Listado paginado desde /admin/api/*: la búsqueda se hace en el servidor.
+// onChange(items, hasMore) se llama cada vez que cambia el contenido.
+class PagedList {
+  constructor(url, key, onChange, limit = 50) {
+    this.url = url;
+    this.key = key;
+    this.onChange = onChange;
+    this.limit = limit;
+    this.params = {};
+    this.items = [];
+    this.cursor = null;
+    this.hasMore = false;
+    this.seq = 0;
+  }
+
+  async reset(params = {}) {
+    this.params = params;
+    this.items = [];
+    this.cursor = null;
+    this.hasMore = false;
+    await this.next();
+  }
+
+  async next() {
+    const seq = ++this.seq;
+    const query = new URLSearchParams({ limit: this.limit });
+    for (const [k, v] of Object.entries(this.params)) if (v) query.set(k, v);
+    if (this.cursor) query.set("cursor", this.cursor);
+    const res = await fetch(`${this.url}?${query}`);
+    if (seq !== this.seq) return;  // llegó una respuesta vieja (se cambió la búsqueda)
+    if (!res.ok) {
+      alert("Error al cargar los datos");
+      return;
+    }
+    const page = await res.json();
+    this.items = this.items.concat(page[this.key]);
+    this.cursor = page.next_cursor;
+    this.hasMore = page.has_more;
+    this.onChange(this.items, this.hasMore);
+  }
+
+  prepend(item) {
+    this.items.unshift(item);
+    this.onChange(this.items, this.hasMore);
+  }
+
+  remove(predicate) {
+    this.items = this.items.filter(x => !predicate(x));
+    this.onChange(this.items, this.hasMore);
+  }
+}
+
+// Proyectos (con su API key): se piden solo cuando una acción los necesita
+const projectCache = {};
+
+async function projectInfo(pid) {
+  if (!(pid in projectCache)) {
+    const res = await fetch(`/projects/${encodeURIComponent(pid)}`);
+    projectCache[pid] = res.ok ? await res.json() : null;
+  }
+  return projectCache[pid];
+}
+
+async function projectApiKey(pid) {
+  return (await projectInfo(pid))?.api_key || "";
+}
+
+async function projectHeaders(pid, extra = {}) {
+  return { ...extra, "X-Project-Id": pid, "X-Api-Key": await projectApiKey(pid) };
+}
+
+// Botón "Cargar más" debajo de un listado
+function moreButton(list) {
+  const button = document.getElementById("more");
+  button.onclick = () => list.next();
+  return hasMore => { button.style.display = hasMore ? "block" : "none"; };
+}
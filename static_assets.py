@@ -0,0 +1,63 @@
+"""
+Archivos estáticos de la interfaz de admin (static/admin), cargados en memoria al iniciar.
+
+- Cada archivo tiene un ETag con el hash de su contenido; si coincide con If-None-Match
+  se responde 304 sin cuerpo.
+- En los .html, `{{asset:nombre}}` se reemplaza por la URL versionada del asset
+  (`/admin/assets/nombre?v=<hash>`). Esas URLs no cambian mientras no cambie el archivo,
+  así que se sirven con caché de un año (immutable); el HTML se revalida en cada carga.
+"""
+from __future__ import annotations
+from typing import Dict, Optional
+import hashlib
+import mimetypes
+import os
+import re
+
+from fastapi import HTTPException, Request
+from fastapi.responses import Response
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+_ASSET_REF = re.compile(r"\{\{asset:([\w.\-]+)\}\}")
+
+
+class Asset:
+    __slots__ = ("body", "etag", "version", "media_type")
+
+    def __init__(self, body: bytes, media_type: str):
+        self.body = body
+        self.version = hashlib.sha256(body).hexdigest()[:16]
+        self.etag = f'"{self.version}"'
+        self.media_type = media_type
+
+
+class StaticAssets:
+    def __init__(self, directory: str, url_prefix: str):
+        self.url_prefix = url_prefix.rstrip("/")
+        self._assets: Dict[str, Asset] = {}
+        names = sorted(os.listdir(directory))
+        # Primero los assets, para poder versionar sus URLs dentro de los HTML
+        for name in sorted(names, key=lambda n: n.endswith(".html")):
+            with open(os.path.join(directory, name), "rb") as f:
+                body = f.read()
+            if name.endswith(".html"):
+                body = _ASSET_REF.sub(lambda m: self.url(m.group(1)), body.decode("utf-8")).encode("utf-8")
+            media_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+            if media_type.startswith("text/") or media_type == "application/javascript":
+                media_type += "; charset=utf-8"
+            self._assets[name] = Asset(body, media_type)
+
+    def url(self, name: str) -> str:
+        return f"{self.url_prefix}/{name}?v={self._assets[name].version}"
+
+    def response(self, name: str, request: Request, version: Optional[str] = None) -> Response:
+        asset = self._assets.get(name)
+        if asset is None:
+            raise HTTPException(404, "Archivo no encontrado")
+        cache = IMMUTABLE if version == asset.version else REVALIDATE
+        headers = {"ETag": asset.etag, "Cache-Control": cache}
+        if asset.etag in (request.headers.get("if-none-match") or ""):
+            return Response(status_code=304, headers=headers)
+        return Response(content=asset.body, media_type=asset.media_type, headers=headers)